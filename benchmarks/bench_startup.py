@@ -0,0 +1,158 @@
+"""
+Import time of the app, first-use latency of the lazily built clients, and
+latency of the first /webhook requests, cold versus after warm_up. Each case
+runs in a fresh interpreter.
+
+Without PROJECT_ID or Application Default Credentials it runs offline: a
+placeholder project is used, clients that need credentials fail to build
+(their times cover the failed attempt) and Firestore-backed code falls back
+to defaults. Telegram is always faked.
+
+    python -m benchmarks.bench_startup
+"""
+import os
+import json
+import subprocess
+import sys
+
+RUNS = 3
+
+IMPORT_CASE = """
+import json, time
+started = time.perf_counter()
+import main
+print(json.dumps({"import main": time.perf_counter() - started}))
+"""
+
+FIRST_USE_CASE = """
+import asyncio, json, time
+from src.services.vertex_ai import vertex_service
+from src.settings_store import get_async_db
+from src.services.warmup import warm_up
+
+WARM = %s
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+results = {}
+if WARM:
+    started = time.perf_counter()
+    asyncio.run(warm_up())
+    results["warm_up"] = time.perf_counter() - started
+results["flash model"] = timed(lambda: vertex_service.flash_model)
+results["image model"] = timed(lambda: vertex_service.image_model)
+results["gcs client"] = timed(lambda: vertex_service.storage_client)
+results["firestore client"] = timed(get_async_db)
+print(json.dumps(results))
+"""
+
+# Webhook to the reply reaching the (fake) Bot API, through the app's lifespan,
+# ingress pipeline and middlewares; the settings menu reads Firestore
+FIRST_REQUEST_CASE = """
+import asyncio, json, time
+import httpx
+from aiogram import methods
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, User
+import main
+from src.middlewares.outbound import outbound_scheduler
+from src.services.warmup import warm_up
+
+WARM = %s
+
+class ReplySession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.replied = asyncio.Event()
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, methods.GetMe):
+            return User(id=123456, is_bot=True, first_name="bench")
+        if isinstance(method, methods.SendMessage):
+            self.replied.set()
+            return Message(message_id=1, date=int(time.time()), chat=Chat(id=method.chat_id, type="private"),
+                           text=method.text).as_(bot)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+async def request(client, session, update_id):
+    session.replied.clear()
+    user = {"id": 1, "is_bot": False, "first_name": "bench"}
+    started = time.perf_counter()
+    await client.post("/webhook", json={"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": {"id": 1, "type": "private"},
+        "from": user, "text": "⚙️ Настройки"
+    }})
+    await asyncio.wait_for(session.replied.wait(), timeout=60)
+    return time.perf_counter() - started
+
+async def run():
+    session = ReplySession()
+    session.middleware(outbound_scheduler)
+    main.bot.session = session
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        if WARM:
+            started = time.perf_counter()
+            await warm_up()
+            results["warm_up"] = time.perf_counter() - started
+        results["first /webhook"] = await request(client, session, 1)
+        results["second /webhook"] = await request(client, session, 2)
+    print(json.dumps(results))
+
+asyncio.run(run())
+"""
+
+def child_env() -> tuple[dict, bool]:
+    """Environment for the cases; offline when there is no project or credentials."""
+    env = dict(os.environ, BOT_TOKEN="123456:BENCH", WEBHOOK_URL="", TELEGRAM_SECRET="",
+               WARMUP_ON_STARTUP="false", TRACE_SAMPLE_RATE="0")
+    offline = False
+    if not env.get("PROJECT_ID"):
+        env["PROJECT_ID"] = "bench-offline"
+        offline = True
+    try:
+        import google.auth
+        google.auth.default()
+    except Exception:
+        offline = True
+    return env, offline
+
+def run(code: str, env: dict) -> dict:
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "no output")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def report(title: str, code: str, env: dict):
+    print(title)
+    try:
+        samples = [run(code, env) for _ in range(RUNS)]
+    except RuntimeError as e:
+        print(f"  failed: {e}")
+        return
+    for name in samples[0]:
+        values = sorted(s[name] for s in samples)
+        print(f"  {name:<18} median {values[len(values) // 2] * 1000:9.1f} ms  max {values[-1] * 1000:9.1f} ms")
+
+def main():
+    env, offline = child_env()
+    if offline:
+        print("offline: no PROJECT_ID or credentials, clients needing them are not built\n")
+    report("import", IMPORT_CASE, env)
+    report("first use, cold", FIRST_USE_CASE % "False", env)
+    report("first use, after warm_up", FIRST_USE_CASE % "True", env)
+    report("first request, cold", FIRST_REQUEST_CASE % "False", env)
+    report("first request, after warm_up", FIRST_REQUEST_CASE % "True", env)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Per-event cost of RateLimitMiddleware and the size of its bucket table.
+
+    python -m benchmarks.bench_throttling
+"""
+import asyncio
+import time
+from aiogram.types import User, Message, Chat
+from src.middlewares.throttling import RateLimitMiddleware, TokenBucket
+
+EVENTS = 200_000
+
+async def _handler(event, data):
+    return True
+
+def _message() -> Message:
+    return Message(message_id=1, date=0, chat=Chat(id=1, type="private"), text="hi")
+
+async def run_case(name: str, users: int, rate: float = 1.0, burst: int = 3):
+    middleware = RateLimitMiddleware(
+        rate=rate,
+        burst=burst,
+        global_bucket=TokenBucket(1e9, 1e9),
+        idle_ttl=60.0
+    )
+    event = _message()
+    payloads = [{"event_from_user": User(id=i, is_bot=False, first_name="u")} for i in range(users)]
+
+    started = time.perf_counter()
+    for i in range(EVENTS):
+        await middleware(_handler, event, payloads[i % users])
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{name:<28} {elapsed / EVENTS * 1e9:8.0f} ns/event  "
+        f"passed={EVENTS - middleware.dropped:<7} dropped={middleware.dropped:<7} buckets={len(middleware.buckets)}"
+    )
+
+async def main():
+    await run_case("single hot user", users=1)
+    await run_case("1k users", users=1_000)
+    await run_case("100k distinct users", users=100_000)
+
+if __name__ == "__main__":
+    asyncio.run(main())
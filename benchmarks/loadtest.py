@@ -0,0 +1,570 @@
+"""
+Offline load test: replays synthetic Telegram updates through the FastAPI app
+in-process, with fake Vertex AI, GCS, Firestore and Bot API backends; FSM state
+goes through the production Firestore storage on the fake.
+No network access or credentials are needed (httpx must be installed).
+
+Virtual users run closed-loop scenarios (chat messages; image mode, settings
+toggles, generation and edits). Reports updates/s, p50/p95/p99 from webhook
+ingress to completion per handler, and peak RSS.
+
+By default the per-model limits and the outbound send scheduler's rates are
+lifted, so the run measures the bot's own overhead rather than the configured
+limits; `--limits config` keeps the production values.
+
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --users 200 --rounds 5 --error-rate 0.05 --image-latency 3
+    python -m benchmarks.loadtest --limits config
+"""
+import os
+
+# Settings are read at import time: configure before importing the app
+os.environ.update({
+    "BOT_TOKEN": "123456:LOADTEST",
+    "PROJECT_ID": "loadtest",
+    "GCS_BUCKET_NAME": "loadtest",
+    "WEBHOOK_URL": "",
+    "TELEGRAM_SECRET": "",
+    "WARMUP_ON_STARTUP": "false",
+    "TRACE_SAMPLE_RATE": "0",
+    "RETRY_BASE_DELAY": "0.05",
+    "RETRY_MAX_DELAY": "0.5",
+})
+
+import io
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+from collections import defaultdict
+from types import SimpleNamespace
+import httpx
+from PIL import Image
+from aiogram import methods
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, File, InputFile, Message, PhotoSize, Document, User
+from google.api_core import exceptions as gexc
+
+import main
+from src.config import settings
+from src.middlewares.outbound import OutboundScheduler, outbound_scheduler
+from src.services.governor import build_governor
+from src.services.imaging import start_pool
+from src.services.vertex_ai import vertex_service
+from src.settings_store import get_async_db, get_db
+
+# ---------------------------------------------------------------- fake backends
+
+class FakeBackend:
+    """Log-normal latency around `latency` seconds and a transient error rate."""
+
+    def __init__(self, name: str, latency: float, error_rate: float = 0.0, sigma: float = 0.5):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sigma = sigma
+        self.calls = 0
+        self.errors = 0
+
+    def _sample(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        # Median equals `latency`
+        return self.latency * math.exp(random.gauss(0, self.sigma))
+
+    def _maybe_fail(self):
+        self.calls += 1
+        if random.random() < self.error_rate:
+            self.errors += 1
+            raise gexc.ServiceUnavailable(f"fake {self.name} unavailable")
+
+    async def call(self):
+        await asyncio.sleep(self._sample())
+        self._maybe_fail()
+
+    def call_sync(self):
+        # GCS client methods run in worker threads
+        time.sleep(self._sample())
+        self._maybe_fail()
+
+def _png(side: int = 512) -> bytes:
+    out = io.BytesIO()
+    Image.effect_noise((side, side), 64).convert("RGB").save(out, format="PNG")
+    return out.getvalue()
+
+class FakeChat:
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+
+    async def send_message_async(self, prompt, stream: bool = False):
+        await self.backend.call()
+        text = f"Ответ на: {prompt} " + "lorem ipsum " * 40
+        if not stream:
+            return SimpleNamespace(text=text)
+
+        async def chunks():
+            for i in range(0, len(text), 120):
+                await asyncio.sleep(self.backend._sample() / 10)
+                yield SimpleNamespace(text=text[i:i + 120])
+        return chunks()
+
+class FakeModel:
+    def __init__(self, backend: FakeBackend, image: bytes = None):
+        self.backend = backend
+        self.image = image
+
+    def start_chat(self, history=None):
+        return FakeChat(self.backend)
+
+    async def count_tokens_async(self, contents):
+        await self.backend.call()
+        return SimpleNamespace(total_tokens=1)
+
+    async def generate_content_async(self, contents):
+        await self.backend.call()
+        parts = [
+            SimpleNamespace(text="An enhanced, detailed prompt", inline_data=None),
+            SimpleNamespace(text=None, inline_data=SimpleNamespace(data=self.image)),
+        ]
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data: bytes, content_type: str = None):
+        self.bucket.backend.call_sync()
+        self.bucket.objects[self.name] = data
+
+    def download_as_bytes(self) -> bytes:
+        self.bucket.backend.call_sync()
+        if self.name not in self.bucket.objects:
+            raise gexc.NotFound(self.name)
+        return self.bucket.objects[self.name]
+
+    def open(self, mode: str = "rb", chunk_size: int = None):
+        return io.BytesIO(self.download_as_bytes())
+
+    def exists(self) -> bool:
+        self.bucket.backend.call_sync()
+        return self.name in self.bucket.objects
+
+class FakeBucket:
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self.objects: dict[str, bytes] = {}
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+class FakeStorageClient:
+    def __init__(self, backend: FakeBackend):
+        self._bucket = FakeBucket(backend)
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self._bucket
+
+class FakeSnapshot:
+    def __init__(self, data, doc_id: str = None):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: tuple):
+        self.db = db
+        self.path = path
+
+    async def get(self, transaction=None):
+        await self.db.backend.call()
+        if transaction is not None:
+            transaction.reads[self.path] = self.db.versions.get(self.path, 0)
+        return FakeSnapshot(self.db.docs.get(self.path), self.path[1])
+
+    async def set(self, data: dict, merge: bool = False):
+        await self.db.backend.call()
+        self.db.write(self.path, data, merge)
+
+class FakeQuery:
+    """Equality filters, document ID order, cursors and limits; `select` is a no-op."""
+
+    def __init__(self, db: "FakeFirestore", name: str, filters=(), after: str = None, count: int = None):
+        self.db = db
+        self.name = name
+        self.filters = filters
+        self.after = after
+        self.count = count
+
+    def _with(self, **changes) -> "FakeQuery":
+        fields = {"filters": self.filters, "after": self.after, "count": self.count, **changes}
+        return FakeQuery(self.db, self.name, **fields)
+
+    def where(self, filter) -> "FakeQuery":
+        assert filter.op_string == "=="
+        return self._with(filters=self.filters + ((filter.field_path, filter.value),))
+
+    def select(self, field_paths) -> "FakeQuery":
+        return self
+
+    def order_by(self, field_path: str) -> "FakeQuery":
+        # Only document ID order is used
+        assert field_path == "__name__"
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._with(count=count)
+
+    def start_after(self, values: dict) -> "FakeQuery":
+        return self._with(after=values["__name__"])
+
+    async def get(self):
+        await self.db.backend.call()
+        docs = sorted(
+            (path[1], data) for path, data in self.db.docs.items()
+            if path[0] == self.name
+            and (self.after is None or path[1] > self.after)
+            and all(data.get(field) == value for field, value in self.filters)
+        )
+        return [FakeSnapshot(data, doc_id) for doc_id, data in docs[:self.count]]
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db: "FakeFirestore", name: str):
+        super().__init__(db, name)
+
+    def document(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self.db, (self.name, doc_id))
+
+class FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref: FakeDocument, data: dict, merge: bool = False):
+        self.writes.append((ref.path, data, merge))
+
+    async def commit(self):
+        await self.db.backend.call()
+        for path, data, merge in self.writes:
+            self.db.write(path, data, merge)
+
+class FakeTransaction:
+    """
+    Optimistic transaction driven by firestore.async_transactional: commit fails
+    with Aborted (and the decorator retries) if a document read changed meanwhile.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db: "FakeFirestore"):
+        self.db = db
+        self._id = None
+        self._clean_up()
+
+    def _clean_up(self):
+        self.reads: dict[tuple, int] = {}
+        self.writes = []
+
+    async def _begin(self, retry_id=None):
+        self._id = object()
+
+    def set(self, ref: FakeDocument, data: dict, merge: bool = False):
+        self.writes.append((ref.path, data, merge))
+
+    async def _commit(self):
+        await self.db.backend.call()
+        if any(self.db.versions.get(path, 0) != version for path, version in self.reads.items()):
+            self._clean_up()
+            raise gexc.Aborted("fake transaction contention")
+        for path, data, merge in self.writes:
+            self.db.write(path, data, merge)
+        self._clean_up()
+
+    async def _rollback(self):
+        self._clean_up()
+
+class FakeFirestore:
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+        self.docs: dict[tuple, dict] = {}
+        self.versions: dict[tuple, int] = {}
+
+    def write(self, path: tuple, data: dict, merge: bool):
+        if merge and path in self.docs:
+            self.docs[path] = {**self.docs[path], **data}
+        else:
+            self.docs[path] = dict(data)
+        self.versions[path] = self.versions.get(path, 0) + 1
+
+    def transaction(self) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+class FakeTelegramSession(BaseSession):
+    """Answers Bot API methods locally; uploads are read through like a real session."""
+
+    def __init__(self, backend: FakeBackend, image: bytes):
+        super().__init__()
+        self.backend = backend
+        self.image = image
+        self.message_ids = 0
+        self.files = 0
+        # chat_id -> photo of the last photo message sent there
+        self.last_photo: dict[int, PhotoSize] = {}
+
+    def _message(self, bot, chat_id: int, **fields) -> Message:
+        self.message_ids += 1
+        return Message(
+            message_id=self.message_ids, date=int(time.time()),
+            chat=Chat(id=chat_id, type="private"), **fields
+        ).as_(bot)
+
+    def _photo(self, chat_id: int) -> list[PhotoSize]:
+        self.files += 1
+        photo = PhotoSize(file_id=f"photo-{self.files}", file_unique_id=f"uid-{self.files}", width=512, height=512)
+        self.last_photo[chat_id] = photo
+        return [photo]
+
+    async def _consume(self, bot, value):
+        if isinstance(value, InputFile):
+            async for _ in value.read(bot):
+                pass
+
+    async def make_request(self, bot, method, timeout=None):
+        await self.backend.call()
+        if isinstance(method, methods.GetMe):
+            return User(id=123456, is_bot=True, first_name="loadtest")
+        if isinstance(method, methods.SendPhoto):
+            await self._consume(bot, method.photo)
+            return self._message(bot, method.chat_id, photo=self._photo(method.chat_id), caption=method.caption)
+        if isinstance(method, methods.SendDocument):
+            await self._consume(bot, method.document)
+            self.files += 1
+            document = Document(file_id=f"doc-{self.files}", file_unique_id=f"docuid-{self.files}")
+            return self._message(bot, method.chat_id, document=document)
+        if isinstance(method, methods.SendMediaGroup):
+            for media in method.media:
+                await self._consume(bot, media.media)
+            return [self._message(bot, method.chat_id, photo=self._photo(method.chat_id)) for _ in method.media]
+        if isinstance(method, methods.GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=f"photos/{method.file_id}.png")
+        if isinstance(method, (methods.SendMessage, methods.EditMessageText)):
+            return self._message(bot, method.chat_id or 0, text=method.text)
+        if isinstance(method, methods.EditMessageReplyMarkup):
+            return self._message(bot, method.chat_id or 0, text="")
+        # answerCallbackQuery, sendChatAction, deleteMessage, setWebhook, ...
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        await self.backend.call()
+        for i in range(0, len(self.image), chunk_size):
+            yield self.image[i:i + chunk_size]
+
+    async def close(self):
+        pass
+
+# ---------------------------------------------------------------- scenarios
+
+class Recorder:
+    """Ingress-to-completion time of every update, labeled by the handler that took it."""
+
+    def __init__(self):
+        self.sent: dict[int, float] = {}
+        self.handler_of: dict[int, str] = {}
+        self.done: dict[int, asyncio.Future] = {}
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+
+    async def outer(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            update_id = event.update_id
+            started = self.sent.pop(update_id, None)
+            if started is not None:
+                label = self.handler_of.pop(update_id, "dropped/unhandled")
+                self.latencies[label].append(time.perf_counter() - started)
+            future = self.done.pop(update_id, None)
+            if future and not future.done():
+                future.set_result(None)
+
+    async def inner(self, handler, event, data):
+        callback = getattr(data.get("handler"), "callback", None)
+        self.handler_of[data["event_update"].update_id] = getattr(callback, "__name__", "unknown")
+        return await handler(event, data)
+
+class VirtualUser:
+    def __init__(self, user_id: int, client: httpx.AsyncClient, recorder: Recorder,
+                 session: FakeTelegramSession, ids, think_time: float):
+        self.user_id = user_id
+        self.client = client
+        self.recorder = recorder
+        self.session = session
+        self.ids = ids
+        self.think_time = think_time
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+        self.busy = 0
+
+    async def _send(self, payload: dict):
+        update_id = next(self.ids)
+        payload["update_id"] = update_id
+        future = asyncio.get_running_loop().create_future()
+        self.recorder.done[update_id] = future
+        self.recorder.sent[update_id] = time.perf_counter()
+        response = await self.client.post("/webhook", json=payload)
+        if response.status_code != 200:
+            # Rejected at ingress (queue full)
+            self.busy += 1
+            self.recorder.sent.pop(update_id, None)
+            self.recorder.done.pop(update_id, None)
+        else:
+            await future
+        if self.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * self.think_time))
+
+    def _msg(self, **fields) -> dict:
+        return {"message_id": 1, "date": int(time.time()), "chat": self.chat, "from": self.user, **fields}
+
+    async def text(self, text: str):
+        await self._send({"message": self._msg(text=text)})
+
+    async def button(self, data: str, with_photo: bool = False):
+        message = self._msg(text="menu")
+        photo = self.session.last_photo.get(self.user_id)
+        if with_photo and photo:
+            message = self._msg(photo=[photo.model_dump(exclude_none=True)], caption="✨ prompt")
+        await self._send({"callback_query": {
+            "id": str(next(self.ids)), "from": self.user, "chat_instance": "ci",
+            "message": message, "data": data
+        }})
+
+    async def chatter(self, rounds: int):
+        for i in range(rounds):
+            await self.text(f"Вопрос {i} от {self.user_id}: как дела?")
+
+    async def artist(self, rounds: int):
+        await self.text("🎨 Текст в фото")
+        for i in range(rounds):
+            await self.button(random.choice(["gen_set_ar_16:9", "gen_set_ar_1:1", "gen_set_magic_off"]))
+            # Some prompts repeat across users to exercise the generation cache
+            prompt = f"кот в космосе {random.randint(0, 20)}" if i % 2 else f"пейзаж {self.user_id}-{i}"
+            await self.text(prompt)
+            await self.button("set_style_art")
+            await self.button("img_edit", with_photo=True)
+            await self.text("сделай небо красным")
+
+# ---------------------------------------------------------------- runner
+
+UNLIMITED = 10 ** 6
+
+def lift_limits() -> OutboundScheduler:
+    """Rebuilds the model governor without limits; returns an unlimited send scheduler."""
+    for model in ("FLASH", "PRO", "IMAGE"):
+        for limit in ("CONCURRENCY", "RATE", "BURST", "QUEUE"):
+            setattr(settings, f"{model}_{limit}", UNLIMITED)
+    vertex_service.governor = build_governor(settings)
+    return OutboundScheduler(global_rate=UNLIMITED, chat_rate=UNLIMITED, group_rate=UNLIMITED, chat_burst=UNLIMITED)
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+    return ordered[index]
+
+async def run(args):
+    random.seed(args.seed)
+    image = _png(args.image_side)
+    backends = {
+        "telegram": FakeBackend("telegram", args.telegram_latency),
+        "vertex_text": FakeBackend("vertex_text", args.text_latency, args.error_rate),
+        "vertex_image": FakeBackend("vertex_image", args.image_latency, args.error_rate),
+        "gcs": FakeBackend("gcs", args.gcs_latency, args.error_rate),
+        "firestore": FakeBackend("firestore", args.firestore_latency, args.error_rate),
+    }
+
+    session = FakeTelegramSession(backends["telegram"], image)
+    # Same request middlewares as the real session
+    session.middleware(lift_limits() if args.limits == "off" else outbound_scheduler)
+    main.bot.session = session
+    vertex_service._models["flash"].override(FakeModel(backends["vertex_text"]))
+    vertex_service._models["pro"].override(FakeModel(backends["vertex_text"]))
+    vertex_service._models["image"].override(FakeModel(backends["vertex_image"], image))
+    vertex_service._storage.override(FakeStorageClient(backends["gcs"]))
+    get_async_db.override(FakeFirestore(backends["firestore"]))
+    # No settings listener: a single instance has nothing to hear about
+    get_db.override(None)
+
+    recorder = Recorder()
+    main.dp.update.outer_middleware(recorder.outer)
+    main.dp.message.middleware(recorder.inner)
+    main.dp.callback_query.middleware(recorder.inner)
+
+    ids = iter(range(1, 10 ** 9))
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app), httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        users = [
+            VirtualUser(i, client, recorder, session, ids, args.think_time)
+            for i in range(1, args.users + 1)
+        ]
+        artists = int(args.users * args.image_share)
+
+        # Image workers start on first use; keep that out of the run
+        await start_pool()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            user.artist(args.rounds) if n < artists else user.chatter(args.rounds * 3)
+            for n, user in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+        stats = main.pipeline.stats()
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    print(f"\n{total} updates in {elapsed:.2f}s: {total / elapsed:.1f} updates/s "
+          f"({args.users} users, {artists} in image mode)")
+    print(f"ingress: processed={stats['processed']} rejected={stats['rejected']} duplicates={stats['duplicates']}")
+    print(f"{'handler':<28} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, values in sorted(recorder.latencies.items()):
+        print(f"{name:<28} {len(values):>6} {percentile(values, 0.5) * 1000:>9.1f} "
+              f"{percentile(values, 0.95) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}")
+    print("backends: " + ", ".join(f"{b.name}={b.calls} calls/{b.errors} errors" for b in backends.values()))
+    # ru_maxrss is KiB on Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--image-share", type=float, default=0.5, help="share of users in image mode")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between a user's updates, s")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="transient error rate of Google backends")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--text-latency", type=float, default=0.3)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--gcs-latency", type=float, default=0.05)
+    parser.add_argument("--firestore-latency", type=float, default=0.01)
+    parser.add_argument("--image-side", type=int, default=512)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--limits", choices=("off", "config"), default="off",
+                        help="model and outbound send limits: lifted, or as configured")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+    asyncio.run(run(args))
@@ -1,11 +1,25 @@
 import logging
 import uvicorn
-from fastapi import FastAPI, Header, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from aiogram import Bot, Dispatcher, types
 from src.config import settings
-from src.handlers import common, chat, image_gen, settings as settings_handler
-from src.middlewares.throttling import RateLimitMiddleware
-from aiogram.fsm.storage.memory import MemoryStorage
+from src.handlers import common, admin, chat, image_gen, settings as settings_handler
+from src.middlewares.throttling import RateLimitMiddleware, TokenBucket
+from src.middlewares.metrics import HandlerMetricsMiddleware
+from src.middlewares.tracing import TracingMiddleware
+from src.middlewares.outbound import outbound_scheduler
+from src.services.chat_store import conversation_store
+from src.fsm_storage import create_fsm_storage
+from src.services.vertex_ai import vertex_service
+from src.ingress import UpdatePipeline, DUPLICATE, BUSY
+from src.services.imaging import shutdown_pool
+from src.services.warmup import start_warm_up
+from src.services.broadcast import broadcaster
+from src.services.health import HealthMonitor, build_checks
+from src.settings_store import firestore_retry, settings_repo
+from src.services.generation_cache import generation_cache
+from src.utils.metrics import registry
 from starlette.status import HTTP_403_FORBIDDEN
 from contextlib import asynccontextmanager
 import asyncio
@@ -17,11 +31,30 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    warmup_task = None
+    resume_task = None
+    watch_task = None
     try:
         logger.info("Starting up application...")
         # Check if project_id is available
         if not settings.PROJECT_ID:
             logger.error("PROJECT_ID environment variable is missing!")
+
+        if pipeline:
+            pipeline.start()
+
+        # Clients are lazy; build them while uvicorn starts accepting requests
+        if settings.WARMUP_ON_STARTUP:
+            warmup_task = start_warm_up()
+
+        health_monitor.start()
+
+        # Drop cached settings as soon as another instance changes them
+        watch_task = asyncio.create_task(settings_repo.watch())
+
+        # Pick up broadcasts left unfinished by a stopped instance
+        if bot:
+            resume_task = asyncio.create_task(broadcaster.resume_pending(bot))
             
         webhook_url = settings.WEBHOOK_URL
         if webhook_url and bot:
@@ -48,6 +81,17 @@ async def lifespan(app: FastAPI):
     
     try:
         logger.info("Shutting down application...")
+        for task in (warmup_task, resume_task, watch_task):
+            if task and not task.done():
+                task.cancel()
+        await health_monitor.stop()
+        if pipeline:
+            await pipeline.stop()
+        await outbound_scheduler.close()
+        # Persist chat histories and settings still waiting for write-behind
+        await conversation_store.close()
+        await settings_repo.close()
+        shutdown_pool()
         # Optional: await bot.delete_webhook()
     except Exception as e:
         logger.error(f"Shutdown error: {e}")
@@ -57,19 +101,92 @@ app = FastAPI(lifespan=lifespan)
 # Initialize Bot and Dispatcher here for Webhook
 try:
     bot = Bot(token=settings.BOT_TOKEN or "dummy_token")
-    dp = Dispatcher(storage=MemoryStorage())
+    # Every request the bot makes goes through the send scheduler
+    bot.session.middleware(outbound_scheduler)
+    dp = Dispatcher(storage=create_fsm_storage())
 except Exception as e:
     logger.error(f"Error initializing Bot/Dispatcher: {e}")
     # We still need these defined for the webhook handler
     bot = None
     dp = None
 
+# Bounded worker pool between the webhook and the dispatcher
+pipeline = UpdatePipeline(
+    dp, bot,
+    workers=settings.INGRESS_WORKERS,
+    max_queue=settings.INGRESS_QUEUE_SIZE,
+    dedup_size=settings.DEDUP_CACHE_SIZE,
+    dedup_ttl=settings.DEDUP_TTL
+) if dp else None
+
+if pipeline:
+    registry.callback(
+        "ingress_updates", "Update pipeline counters",
+        lambda: {(key,): value for key, value in pipeline.stats().items()}, ("stat",)
+    )
+registry.callback(
+    "model_limiter", "Per-model limiter state (in_flight, queue_depth, admitted, shed, ...)",
+    lambda: {
+        (model, key): value
+        for model, stats in vertex_service.governor.stats().items()
+        for key, value in stats.items()
+    },
+    ("model", "stat")
+)
+registry.callback(
+    "outbound_scheduler", "Outbound send scheduler state (pending, in_flight, chats)",
+    lambda: {(key,): value for key, value in outbound_scheduler.stats().items()}, ("stat",)
+)
+registry.callback(
+    "generation_cache_lookups_total", "Generation cache lookups",
+    lambda: {("hit",): generation_cache.hits, ("miss",): generation_cache.misses}, ("result",), type="counter"
+)
+
+# Dependency states for /readyz, refreshed in the background
+health_monitor = HealthMonitor(
+    build_checks(bot),
+    required=("telegram",) if bot else (),
+    interval=settings.HEALTH_CHECK_INTERVAL,
+    timeout=settings.HEALTH_CHECK_TIMEOUT
+)
+
 # Setup middlewares
 if dp:
-    dp.message.middleware(RateLimitMiddleware(limit=1.0))
+    # Root span per update; everything awaited below it joins the trace
+    dp.update.outer_middleware(TracingMiddleware())
+
+    # Global bucket is shared by messages and callback queries
+    global_bucket = TokenBucket(settings.GLOBAL_RATE_LIMIT, settings.GLOBAL_BURST)
+    rate_limiters = {
+        "message": RateLimitMiddleware(
+            rate=settings.MESSAGE_RATE_LIMIT,
+            burst=settings.MESSAGE_BURST,
+            global_bucket=global_bucket,
+            idle_ttl=settings.RATE_LIMIT_IDLE_TTL
+        ),
+        "callback_query": RateLimitMiddleware(
+            rate=settings.CALLBACK_RATE_LIMIT,
+            burst=settings.CALLBACK_BURST,
+            global_bucket=global_bucket,
+            idle_ttl=settings.RATE_LIMIT_IDLE_TTL
+        ),
+    }
+    dp.message.middleware(rate_limiters["message"])
+    dp.callback_query.middleware(rate_limiters["callback_query"])
+
+    # After throttling, so dropped updates aren't timed as handler calls
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+    # Scraped from existing counters; nothing extra on the hot path
+    registry.callback(
+        "rate_limit_dropped_total", "Updates dropped by rate limiting",
+        lambda: {(kind,): m.dropped for kind, m in rate_limiters.items()}, ("kind",), type="counter"
+    )
 
     # Include routers
     dp.include_router(common.router)
+    dp.include_router(admin.router)
     dp.include_router(image_gen.router) # Moved UP
     dp.include_router(settings_handler.router)
     dp.include_router(chat.router) # Moved DOWN
@@ -77,7 +194,6 @@ if dp:
 @app.post("/webhook")
 async def webhook(
     update: dict, 
-    background_tasks: BackgroundTasks,
     x_telegram_bot_api_secret_token: str = Header(None)
 ):
     if not bot or not dp:
@@ -89,24 +205,45 @@ async def webhook(
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Forbidden")
 
     telegram_update = types.Update(**update)
-    background_tasks.add_task(dp.feed_update, bot, telegram_update)
+    status = pipeline.submit(telegram_update)
+    if status == BUSY:
+        # Non-2xx makes Telegram redeliver the update later
+        logger.warning(f"Ingress queue full, rejecting update {telegram_update.update_id}")
+        raise HTTPException(status_code=503, detail="Busy", headers={"Retry-After": "5"})
+    if status == DUPLICATE:
+        logger.info(f"Duplicate update {telegram_update.update_id} dropped")
     return {"ok": True}
 
 @app.get("/")
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/livez")
+async def livez():
+    # Liveness: the event loop answers; no dependency is touched
+    return {"status": "ok"}
+
+@app.get("/readyz")
 @app.get("/health")
-async def health_check():
-    # Basic check to see if bot is responsive
-    try:
-        if bot:
-            await bot.get_me()
-            return {"status": "healthy", "bot": "ok"}
-        return {"status": "degraded", "bot": "not_initialized"}
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {"status": "unhealthy", "error": str(e)}
+async def readyz():
+    # Readiness from cached states only; the monitor does the probing
+    ready = bool(bot and pipeline) and health_monitor.ready
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "dependencies": health_monitor.snapshot(),
+        "circuits": {
+            name: policy.breaker.state
+            for name, policy in {**vertex_service.retry, "firestore": firestore_retry}.items()
+            if policy.breaker
+        },
+        "ingress": pipeline.stats() if pipeline else None,
+        "models": vertex_service.governor.stats()
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8080))
@@ -1,27 +1,45 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from src.config import settings
-from src.handlers import common, chat, image_gen, settings as settings_handler
+from src.handlers import common, admin, chat, image_gen, settings as settings_handler
+from src.middlewares.outbound import outbound_scheduler
+from src.services.chat_store import conversation_store
+from src.settings_store import settings_repo
+from src.fsm_storage import create_fsm_storage
+from src.services.warmup import start_warm_up
+from src.services.imaging import shutdown_pool
 
 # Logging setup
 logging.basicConfig(level=logging.INFO)
 
 async def main():
     bot = Bot(token=settings.BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+    bot.session.middleware(outbound_scheduler)
+    dp = Dispatcher(storage=create_fsm_storage())
     
     # Register routers
     dp.include_router(common.router)
+    dp.include_router(admin.router)
     dp.include_router(settings_handler.router)
     dp.include_router(image_gen.router)
     dp.include_router(chat.router) # Chat router last to catch text messages
 
+    warmup_task = start_warm_up() if settings.WARMUP_ON_STARTUP else None
+    await settings_repo.watch()
+
     # Start polling (for local dev) or webhook (for cloud run)
     # For MVP local dev:
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if warmup_task and not warmup_task.done():
+            warmup_task.cancel()
+        await outbound_scheduler.close()
+        await conversation_store.close()
+        await settings_repo.close()
+        shutdown_pool()
 
 if __name__ == "__main__":
     asyncio.run(main())
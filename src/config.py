@@ -22,7 +22,127 @@ class Settings(BaseSettings):
     PROJECT_ID: str = ""
     GCS_BUCKET_NAME: Optional[str] = None
     REGION: str = "global"
-    
+
+    # Кэш пользовательских настроек (в памяти инстанса)
+    SETTINGS_CACHE_SIZE: int = 10000
+    # Изменения с других инстансов сбрасывают кэш сразу (слушатель Firestore);
+    # TTL ограничивает устаревание, только если слушатель недоступен
+    SETTINGS_CACHE_TTL: float = 300.0
+    # Быстрые переключения настроек объединяются в одну запись за это время (сек)
+    SETTINGS_WRITE_DELAY: float = 1.0
+
+    # Кэш истории чата с отложенной записью в Firestore
+    CHAT_CACHE_SIZE: int = 5000
+    CHAT_HISTORY_LIMIT: int = 40
+    CHAT_FLUSH_INTERVAL: float = 5.0
+
+    # Бюджет токенов контекста чата по моделям; старые реплики сворачиваются в краткое содержание
+    FLASH_HISTORY_TOKENS: int = 6000
+    PRO_HISTORY_TOKENS: int = 12000
+    CHAT_SUMMARIZE: bool = True
+
+    # Потоковая выдача ответов чата (прогрессивное редактирование сообщения)
+    CHAT_STREAMING: bool = True
+    STREAM_EDIT_INTERVAL: float = 1.0
+
+    # Ограничение нагрузки на модели: параллельные вызовы, запросов/сек, всплеск, длина очереди
+    FLASH_CONCURRENCY: int = 20
+    FLASH_RATE: float = 5.0
+    FLASH_BURST: int = 20
+    FLASH_QUEUE: int = 100
+    PRO_CONCURRENCY: int = 8
+    PRO_RATE: float = 2.0
+    PRO_BURST: int = 8
+    PRO_QUEUE: int = 50
+    IMAGE_CONCURRENCY: int = 4
+    IMAGE_RATE: float = 0.5
+    IMAGE_BURST: int = 4
+    IMAGE_QUEUE: int = 20
+
+    # Повторы при временных ошибках и автоматический выключатель (circuit breaker)
+    RETRY_MAX_ATTEMPTS: int = 4
+    RETRY_BASE_DELAY: float = 1.0
+    RETRY_MAX_DELAY: float = 20.0
+    TEXT_RETRY_DEADLINE: float = 180.0
+    IMAGE_RETRY_DEADLINE: float = 420.0
+    STORAGE_RETRY_DEADLINE: float = 60.0
+    FIRESTORE_RETRY_DEADLINE: float = 15.0
+    # Повтор не начинается, если от бюджета осталось меньше (сек)
+    RETRY_MIN_ATTEMPT: float = 2.0
+    CIRCUIT_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_RESET_TIMEOUT: float = 30.0
+
+    # Обработка входящих апдейтов вебхука: воркеры, длина очереди, дедупликация update_id
+    INGRESS_WORKERS: int = 32
+    INGRESS_QUEUE_SIZE: int = 1000
+    DEDUP_CACHE_SIZE: int = 10000
+    DEDUP_TTL: float = 3600.0
+
+    # Хранилище FSM: firestore (общее для всех инстансов), local или memory
+    FSM_STORAGE: str = "firestore"
+    FSM_CACHE_SIZE: int = 10000
+    FSM_CACHE_TTL: float = 2.0
+
+    # Ограничение частоты запросов (token bucket): на пользователя и глобально
+    MESSAGE_RATE_LIMIT: float = 1.0
+    MESSAGE_BURST: int = 3
+    CALLBACK_RATE_LIMIT: float = 3.0
+    CALLBACK_BURST: int = 6
+    GLOBAL_RATE_LIMIT: float = 50.0
+    GLOBAL_BURST: int = 100
+    RATE_LIMIT_IDLE_TTL: float = 60.0
+
+    # Кэш готовых генераций (промпт + настройки -> file_id / GCS)
+    GEN_CACHE_SIZE: int = 2000
+    GEN_CACHE_TTL: float = 86400.0
+
+    # Последние оригиналы изображений пользователей для цепочек редактирования (байт)
+    WORKING_IMAGE_CACHE_BYTES: int = 128 * 1024 * 1024
+
+    # Сколько вариантов генерировать по кнопке «Еще вариант» (1 — по одному)
+    IMAGE_VARIANTS: int = 4
+
+    # Фоновая загрузка оригиналов в GCS
+    UPLOAD_WAIT_TIMEOUT: float = 60.0
+
+    # file_id уже отправленных оригиналов (по имени объекта GCS)
+    DOCUMENT_ID_CACHE_SIZE: int = 10000
+
+    # Превью для answer_photo (оригинал без потерь остается в GCS)
+    IMAGE_WORKERS: int = 2
+    PREVIEW_FORMAT: str = "JPEG"  # JPEG или WEBP
+    PREVIEW_QUALITY: int = 85
+    PREVIEW_MAX_SIDE: int = 2560
+
+    # Максимальная сторона входного изображения для редактирования
+    EDIT_INPUT_MAX_SIDE: int = 2048
+
+    # Прогрев клиентов Vertex AI / GCS / Firestore в фоне при старте
+    WARMUP_ON_STARTUP: bool = True
+
+    # Фоновая проверка зависимостей для /readyz (секунды)
+    HEALTH_CHECK_INTERVAL: float = 30.0
+    HEALTH_CHECK_TIMEOUT: float = 5.0
+
+    # Трассировка: доля записываемых трасс; медленные (сек) и с ошибками пишутся всегда
+    TRACE_SAMPLE_RATE: float = 0.01
+    TRACE_SLOW_THRESHOLD: float = 5.0
+
+    # Рассылка: администраторы, темп (сообщений/сек, с запасом до лимита Telegram ~30/сек), чекпоинты
+    ADMIN_IDS: list[int] = []
+    BROADCAST_RATE: float = 20.0
+    BROADCAST_WORKERS: int = 16
+    BROADCAST_PAGE_SIZE: int = 500
+    BROADCAST_LEASE: float = 120.0
+
+    # Исходящие сообщения: общий темп (сообщений/сек), темп на личный и групповой чат, всплеск на чат,
+    # сколько раз повторять запрос после RetryAfter
+    OUTBOUND_GLOBAL_RATE: float = 30.0
+    OUTBOUND_CHAT_RATE: float = 1.0
+    OUTBOUND_GROUP_RATE: float = 0.33
+    OUTBOUND_CHAT_BURST: int = 3
+    OUTBOUND_MAX_RETRIES: int = 5
+
     # App / Server
     # Cloud Run автоматически передает PORT. Pydantic подхватит его из переменных окружения.
     PORT: int = 8080
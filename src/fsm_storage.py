@@ -0,0 +1,164 @@
+import copy
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Mapping, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from google.cloud import firestore
+from src.config import settings
+from src.settings_store import get_async_db, firestore_retry
+from src.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Conflicting writes are re-applied on a fresh read this many times
+MAX_WRITE_ATTEMPTS = 5
+
+@dataclass
+class FSMRecord:
+    state: Optional[str] = None
+    data: dict = field(default_factory=dict)
+    version: int = 0
+
+class InMemoryFSMBackend:
+    """Local stand-in for FirestoreFSMBackend with the same versioning semantics."""
+
+    def __init__(self):
+        self.records: dict[str, FSMRecord] = {}
+
+    async def read(self, doc_id: str) -> FSMRecord:
+        return copy.deepcopy(self.records.get(doc_id, FSMRecord()))
+
+    async def write(self, doc_id: str, record: FSMRecord, expected_version: int) -> bool:
+        current = self.records.get(doc_id, FSMRecord())
+        if current.version != expected_version:
+            return False
+        self.records[doc_id] = copy.deepcopy(record)
+        return True
+
+class FirestoreFSMBackend:
+    """
+    Stores one FSM record per storage key in the `fsm_states` collection.
+    The client is built on first use; if Firestore is unavailable the
+    records are kept in process memory instead.
+    """
+
+    def __init__(self, client_factory, collection: str = "fsm_states"):
+        self.client_factory = client_factory
+        self.collection = collection
+        self.fallback = None
+
+    @property
+    def client(self):
+        client = self.client_factory()
+        if client is None and self.fallback is None:
+            logger.warning("Firestore unavailable, keeping FSM state in memory")
+            self.fallback = InMemoryFSMBackend()
+        return client
+
+    def _doc(self, doc_id: str):
+        return self.client.collection(self.collection).document(doc_id)
+
+    async def read(self, doc_id: str) -> FSMRecord:
+        if self.client is None:
+            return await self.fallback.read(doc_id)
+        doc = await firestore_retry.call(self._doc(doc_id).get)
+        if not doc.exists:
+            return FSMRecord()
+        raw = doc.to_dict()
+        return FSMRecord(state=raw.get("state"), data=raw.get("data") or {}, version=raw.get("version", 0))
+
+    async def write(self, doc_id: str, record: FSMRecord, expected_version: int) -> bool:
+        if self.client is None:
+            return await self.fallback.write(doc_id, record, expected_version)
+        ref = self._doc(doc_id)
+
+        @firestore.async_transactional
+        async def _txn(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            current = snapshot.get("version") if snapshot.exists else 0
+            if current != expected_version:
+                return False
+            transaction.set(ref, {"state": record.state, "data": record.data, "version": record.version})
+            return True
+
+        # Fresh transaction object per attempt
+        return await firestore_retry.call(lambda: _txn(self.client.transaction()))
+
+class CachedFSMStorage(BaseStorage):
+    """
+    aiogram FSM storage shared between instances through a versioned backend.
+
+    Reads are served from a short-TTL local cache. Every write carries the
+    version it was based on; if another instance wrote in between, the change
+    is re-applied on top of a fresh read.
+    """
+
+    def __init__(self, backend, cache_size: int = 10000, cache_ttl: float = 2.0):
+        self.backend = backend
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    @staticmethod
+    def _doc_id(key: StorageKey) -> str:
+        parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+        if key.thread_id:
+            parts.append(f"t{key.thread_id}")
+        if key.business_connection_id:
+            parts.append(f"b{key.business_connection_id}")
+        parts.append(key.destiny)
+        return ":".join(parts)
+
+    async def _read(self, doc_id: str, fresh: bool = False) -> FSMRecord:
+        record = None if fresh else self.cache.get(doc_id)
+        if record is None:
+            record = await self.backend.read(doc_id)
+            self.cache.set(doc_id, record)
+        return record
+
+    async def _mutate(self, key: StorageKey, change: Callable[[FSMRecord], FSMRecord]) -> FSMRecord:
+        doc_id = self._doc_id(key)
+        record = await self._read(doc_id)
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            new_record = change(record)
+            new_record.version = record.version + 1
+            if await self.backend.write(doc_id, new_record, expected_version=record.version):
+                self.cache.set(doc_id, new_record)
+                return new_record
+            # Someone else wrote first: retry on top of their version
+            record = await self._read(doc_id, fresh=True)
+        raise RuntimeError(f"FSM write conflict for {doc_id} persisted after {MAX_WRITE_ATTEMPTS} attempts")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._mutate(key, lambda r: FSMRecord(state=state, data=r.data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._read(self._doc_id(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        data = dict(data)
+        await self._mutate(key, lambda r: FSMRecord(state=r.state, data=data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return copy.deepcopy((await self._read(self._doc_id(key))).data)
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> dict[str, Any]:
+        # Merge inside the versioned write so concurrent updates aren't lost
+        record = await self._mutate(key, lambda r: FSMRecord(state=r.state, data={**r.data, **data}))
+        return copy.deepcopy(record.data)
+
+    async def close(self) -> None:
+        self.cache.clear()
+
+def create_fsm_storage() -> BaseStorage:
+    """Firestore-backed storage unless FSM_STORAGE selects a local one."""
+    if settings.FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if settings.FSM_STORAGE == "local":
+        return CachedFSMStorage(InMemoryFSMBackend(), cache_size=settings.FSM_CACHE_SIZE, cache_ttl=settings.FSM_CACHE_TTL)
+    return CachedFSMStorage(
+        FirestoreFSMBackend(get_async_db),
+        cache_size=settings.FSM_CACHE_SIZE,
+        cache_ttl=settings.FSM_CACHE_TTL
+    )
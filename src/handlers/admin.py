@@ -0,0 +1,44 @@
+from aiogram import Router, F
+from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+from src.config import settings
+from src.services.broadcast import broadcaster
+
+router = Router()
+# Commands are silently ignored for everyone else
+router.message.filter(F.from_user.id.in_(settings.ADMIN_IDS))
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, command: CommandObject):
+    # /broadcast <текст> или ответом на сообщение, которое нужно разослать
+    if message.reply_to_message:
+        job = await broadcaster.start(
+            message.bot,
+            from_chat_id=message.chat.id,
+            message_id=message.reply_to_message.message_id
+        )
+    elif command.args:
+        job = await broadcaster.start(message.bot, text=command.args)
+    else:
+        await message.answer("Использование: /broadcast <текст> или ответом на сообщение.")
+        return
+    await message.answer(f"📣 Рассылка {job.job_id} запущена.")
+
+@router.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: Message, command: CommandObject):
+    job = await broadcaster.get_job((command.args or "").strip())
+    if job is None:
+        await message.answer("Рассылка не найдена.")
+        return
+    await message.answer(
+        f"📣 {job.job_id}: {job.status}\n"
+        f"Отправлено: {job.sent}, заблокировали бота: {job.blocked}, ошибок: {job.failed}\n"
+        f"Скорость: {job.rate:.1f} сообщ./сек"
+    )
+
+@router.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: Message, command: CommandObject):
+    if await broadcaster.cancel((command.args or "").strip()):
+        await message.answer("⏹ Рассылка остановлена.")
+    else:
+        await message.answer("Рассылка не найдена на этом инстансе.")
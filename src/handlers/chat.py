@@ -2,21 +2,18 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from src.services.vertex_ai import vertex_service
+from src.services.governor import ModelBusyError
 from src.keyboards.settings_kbs import get_chat_response_keyboard
-from src.settings_store import db
+from src.services.chat_store import conversation_store
+from src.services.streaming import StreamingReply
+from src.config import settings
 from src.states import GenStates
-from vertexai.generative_models import Content, Part
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 
-def get_context_ref(user_id: int):
-    if db:
-        return db.collection("chat_contexts").document(str(user_id))
-    return None
-
 @router.message(F.text.in_({"🔘 Чат (Gemini)", "💬 Чат"}))
 async def chat_mode_entry(message: Message):
     await message.answer("💬 Режим чата активирован. Пиши любой вопрос!")
@@ -28,45 +25,62 @@ async def chat_handler(message: Message, state: FSMContext):
     if current_state in [GenStates.prompt_wait, GenStates.edit_wait, GenStates.img2img_text_wait]:
         return # Игнорируем, так как это должен обработать image_gen.py
     user_id = message.from_user.id
-    history = []
-    raw_history = []
-    
-    ref = get_context_ref(user_id)
-    if ref:
-        doc = ref.get()
-        if doc.exists:
-            raw_history = doc.to_dict().get("history", [])
-            # Convert raw dicts to Content objects for Vertex AI
-            try:
-                history = [
-                    Content(role=h["role"], parts=[Part.from_text(str(p)) for p in h["parts"]])
-                    for h in raw_history
-                ]
-            except Exception as e:
-                logger.error(f"History conversion error: {e}")
-                history = []
+    # Served from memory for active chats; Firestore is read only on a cache miss
+    history = await conversation_store.get_history(user_id)
     
     msg = await message.answer("⏳ Думаю...")
     
+    if settings.CHAT_STREAMING:
+        await stream_chat_reply(message, msg, history)
+        return
+    
     try:
-        response = await vertex_service.generate_text(message.text, history=history)
+        response = await vertex_service.generate_text(message.text, history=history, user_id=user_id)
         
-        if ref:
-            raw_history.append({"role": "user", "parts": [message.text]})
-            raw_history.append({"role": "model", "parts": [response]})
-            # Keep last 10 messages (5 turns)
-            ref.set({"history": raw_history[-10:]})
+        # Keeps the last CHAT_HISTORY_LIMIT messages, persisted in the background
+        await conversation_store.append(user_id, message.text, response)
         
         await msg.edit_text(response, reply_markup=get_chat_response_keyboard())
+        # Reply is out; fold old turns into the summary if the history got too long
+        conversation_store.summarize_later(user_id)
+    except ModelBusyError as e:
+        logger.warning(f"Chat request rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
     except Exception as e:
         logger.error(f"Chat error: {e}", exc_info=True)
         await msg.edit_text("❌ Произошла ошибка при обращении к AI. Попробуйте позже.")
 
+async def stream_chat_reply(message: Message, msg: Message, history: list):
+    # Показываем ответ по мере генерации, а не после полного ответа модели
+    reply = StreamingReply(msg, min_interval=settings.STREAM_EDIT_INTERVAL)
+    try:
+        async for chunk in vertex_service.generate_text_stream(message.text, history=history):
+            await reply.feed(chunk)
+        
+        if not reply.text:
+            raise ValueError("Empty response from model")
+        
+        await conversation_store.append(message.from_user.id, message.text, reply.text)
+        await reply.finish(reply_markup=get_chat_response_keyboard())
+        # Reply is out; fold old turns into the summary if the history got too long
+        conversation_store.summarize_later(message.from_user.id)
+    except ModelBusyError as e:
+        logger.warning(f"Chat request rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
+    except Exception as e:
+        logger.error(f"Chat stream error: {e}", exc_info=True)
+        try:
+            if reply.text:
+                reply.text += "\n\n⚠️ Ответ прерван из-за ошибки."
+                await reply.finish()
+            else:
+                await msg.edit_text("❌ Произошла ошибка при обращении к AI. Попробуйте позже.")
+        except Exception:
+            logger.error("Could not send error message to user.")
+
 @router.callback_query(F.data == "chat_clear")
 async def clear_context(callback: CallbackQuery):
     user_id = callback.from_user.id
-    ref = get_context_ref(user_id)
-    if ref:
-        ref.delete()
+    await conversation_store.clear(user_id)
     await callback.message.edit_text("🗑 Контекст очищен!")
     await callback.answer()
@@ -1,13 +1,23 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 from src.services.vertex_ai import vertex_service
-from src.keyboards.settings_kbs import get_image_response_keyboard
+from src.services.governor import ModelBusyError
+from src.services.generation_cache import generation_cache, generation_key, CachedGeneration
+from src.services.working_images import working_images
+from src.services.persistence import persistence
+from src.services.downloads import GCSInputFile, document_ids
+from src.services.imaging import make_preview, prepare_input
+from src.keyboards.settings_kbs import get_image_response_keyboard, get_variants_keyboard
 from src.keyboards.image_gen_kbs import get_generation_settings_keyboard
 from src.states import GenStates
-from src.settings_store import get_user_settings, update_user_setting
+from src.settings_store import get_user_settings, apply_user_setting
+from src.utils.markup import same_markup
+from src.config import settings as app_settings
 from aiogram.exceptions import TelegramBadRequest
+import asyncio
 import logging
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +28,7 @@ async def image_mode_entry(message: Message, state: FSMContext):
     await state.set_state(GenStates.prompt_wait)
     
     user_id = message.from_user.id
-    settings = get_user_settings(user_id)
+    settings = await get_user_settings(user_id)
     ar = settings.get("aspect_ratio", "1:1")
     style = settings.get("style", "photo")
     magic = settings.get("magic_prompt", True)
@@ -43,6 +53,8 @@ async def img2img_mode_entry(message: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("gen_set_"))
 async def quick_settings_callback(callback: CallbackQuery, state: FSMContext):
     # Format: gen_set_ar_1:1 or gen_set_style_photo or gen_set_magic_on/off or gen_set_res_4K
+    # Stop the button spinner first; the change is applied locally and written later
+    await callback.answer()
     try:
         parts = callback.data.split("_")
             
@@ -52,34 +64,41 @@ async def quick_settings_callback(callback: CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
         
         if action == "ar":
-            update_user_setting(user_id, "aspect_ratio", value)
+            user_settings = await apply_user_setting(user_id, "aspect_ratio", value)
         elif action == "style":
-            update_user_setting(user_id, "style", value)
+            user_settings = await apply_user_setting(user_id, "style", value)
         elif action == "magic":
             is_on = (value == "on")
-            update_user_setting(user_id, "magic_prompt", is_on)
+            user_settings = await apply_user_setting(user_id, "magic_prompt", is_on)
         elif action == "res":
-            update_user_setting(user_id, "resolution", value)
+            user_settings = await apply_user_setting(user_id, "resolution", value)
+        else:
+            user_settings = await get_user_settings(user_id)
             
         # Refresh keyboard
-        user_settings = get_user_settings(user_id)
         ar = user_settings.get("aspect_ratio", "1:1")
         style = user_settings.get("style", "photo")
         magic = user_settings.get("magic_prompt", True)
         res = user_settings.get("resolution", "Standard")
         
-        await callback.message.edit_reply_markup(
-            reply_markup=get_generation_settings_keyboard(ar, style, magic, res)
-        )
+        markup = get_generation_settings_keyboard(ar, style, magic, res)
+        # Re-tapping the active option changes nothing: skip the edit
+        if not same_markup(callback.message.reply_markup, markup):
+            await callback.message.edit_reply_markup(reply_markup=markup)
     except TelegramBadRequest as e:
-        if "message is not modified" in str(e).lower():
-            pass
-        else:
-            logger.error(f"Telegram error: {e}")
+        logger.error(f"Telegram error: {e}")
     except Exception as e:
         logger.error(f"Settings callback error: {e}", exc_info=True)
-        
-    await callback.answer()
+
+def build_caption(magic_prompt: bool, model_text: str, user_prompt: str) -> str:
+    if magic_prompt:
+        caption_text = f"✨ Magic Prompt:\n{model_text}"
+    else:
+        caption_text = f"✨ {user_prompt}"
+
+    if len(caption_text) > 1024:
+        caption_text = caption_text[:1021] + "..."
+    return caption_text
 
 @router.message(GenStates.prompt_wait, F.text)
 async def process_image_prompt(message: Message, state: FSMContext):
@@ -87,12 +106,32 @@ async def process_image_prompt(message: Message, state: FSMContext):
     user_id = message.from_user.id
     
     # Get user settings
-    user_settings = get_user_settings(user_id)
+    user_settings = await get_user_settings(user_id)
     aspect_ratio = user_settings.get("aspect_ratio", "1:1")
     style = user_settings.get("style", "photo")
     magic_prompt = user_settings.get("magic_prompt", True)
     resolution = user_settings.get("resolution", "Standard")
     
+    # Same prompt with the same settings was generated recently: resend by file_id
+    cache_key = generation_key(user_prompt, aspect_ratio, style, magic_prompt, resolution)
+    cached = generation_cache.get(cache_key)
+    if cached:
+        try:
+            result_msg = await message.answer_photo(
+                photo=cached.file_id,
+                caption=build_caption(magic_prompt, cached.model_text, user_prompt),
+                reply_markup=get_image_response_keyboard()
+            )
+            await state.update_data(
+                last_prompt=user_prompt,
+                last_image_id=cached.file_id,
+                last_image_uid=result_msg.photo[-1].file_unique_id if result_msg.photo else None,
+                gcs_file_name=cached.gcs_file_name
+            )
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"Cached generation could not be resent, generating anew: {e}")
+    
     magic_status = "ON" if magic_prompt else "OFF"
     msg = await message.answer(f"🎨 Генерирую... (AR: {aspect_ratio}, Style: {style}, Magic: {magic_status}, Res: {resolution})")
     
@@ -124,39 +163,42 @@ async def process_image_prompt(message: Message, state: FSMContext):
             )
         
         # Single call to Gemini 3 Image
-        image_bytes, model_text = await vertex_service.generate_image(full_user_prompt, aspect_ratio=aspect_ratio)
+        image_bytes, model_text = await vertex_service.generate_image(
+            full_user_prompt, aspect_ratio=aspect_ratio, user_id=user_id
+        )
         
-        # Save to GCS for later download
-        gcs_file_name = await vertex_service.upload_to_gcs(image_bytes)
+        # Save to GCS for later download, overlapping with the Telegram send
+        upload = persistence.start(image_bytes)
         
-        photo_file = BufferedInputFile(image_bytes, filename="image.png")
+        photo_file = await make_preview(image_bytes, "image")
         
         await msg.delete()
         
-        if magic_prompt:
-            caption_text = f"✨ Magic Prompt:\n{model_text}"
-        else:
-            caption_text = f"✨ {user_prompt}"
-
-        if len(caption_text) > 1024:
-            caption_text = caption_text[:1021] + "..."
-
         result_msg = await message.answer_photo(
             photo=photo_file,
-            caption=caption_text,
+            caption=build_caption(magic_prompt, model_text, user_prompt),
             reply_markup=get_image_response_keyboard()
         )
         
         if result_msg.photo:
-            file_id = result_msg.photo[-1].file_id
+            photo = result_msg.photo[-1]
+            cached = CachedGeneration(photo.file_id, None, model_text)
+            generation_cache.put(cache_key, cached)
+            working_images.put(user_id, image_bytes, photo.file_unique_id)
+            persistence.register(upload, photo.file_unique_id)
             await state.update_data(
                 last_prompt=user_prompt,
-                last_image_id=file_id,
-                gcs_file_name=gcs_file_name
+                last_image_id=photo.file_id,
+                last_image_uid=photo.file_unique_id,
+                gcs_file_name=None
             )
+            persistence.track(upload, photo.file_unique_id, state, on_done=lambda name: setattr(cached, "gcs_file_name", name))
         else:
             logger.error("No photo found in result message")
         
+    except ModelBusyError as e:
+        logger.warning(f"Image generation rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
     except Exception as e:
         logger.error(f"Image generation failed: {e}", exc_info=True)
         try:
@@ -196,19 +238,21 @@ async def process_img2img_instruction(message: Message, state: FSMContext):
     msg = await message.answer("🎨 Обрабатываю ваше изображение...")
 
     try:
-        # Download from Telegram
-        bot = message.bot
-        file = await bot.get_file(file_id)
-        image_io = await bot.download_file(file.file_path)
-        image_bytes = image_io.read()
+        # Memory first, Telegram download otherwise
+        image_bytes = await working_images.fetch(message.from_user.id, message.bot, file_id)
+
+        # Real format, no metadata, no more pixels than the model uses
+        input_bytes, mime_type = await prepare_input(image_bytes)
 
         # Use edit_image from vertex_service (it handles image + text prompt)
-        edited_image_bytes = await vertex_service.edit_image(image_bytes, instruction)
+        edited_image_bytes = await vertex_service.edit_image(
+            input_bytes, instruction, mime_type=mime_type, user_id=message.from_user.id
+        )
         
-        # Save to GCS
-        new_gcs_file = await vertex_service.upload_to_gcs(edited_image_bytes)
+        # Save to GCS in the background
+        upload = persistence.start(edited_image_bytes)
         
-        photo_file = BufferedInputFile(edited_image_bytes, filename="img2img_result.png")
+        photo_file = await make_preview(edited_image_bytes, "img2img_result")
         
         await msg.delete()
         
@@ -222,12 +266,20 @@ async def process_img2img_instruction(message: Message, state: FSMContext):
         )
         
         if result_msg.photo:
+            photo = result_msg.photo[-1]
+            working_images.put(message.from_user.id, edited_image_bytes, photo.file_unique_id)
+            persistence.register(upload, photo.file_unique_id)
             await state.update_data(
-                last_image_id=result_msg.photo[-1].file_id,
-                gcs_file_name=new_gcs_file,
+                last_image_id=photo.file_id,
+                last_image_uid=photo.file_unique_id,
+                gcs_file_name=None,
                 last_prompt=instruction
             )
+            persistence.track(upload, photo.file_unique_id, state)
             
+    except ModelBusyError as e:
+        logger.warning(f"Image-to-Image rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
     except Exception as e:
         logger.error(f"Image-to-Image failed: {e}", exc_info=True)
         await msg.edit_text("❌ Произошла ошибка при обработке изображения.")
@@ -242,45 +294,74 @@ async def download_image(callback: CallbackQuery, state: FSMContext):
     await callback.answer("⏳ Скачиваю оригинал из Google Cloud...")
 
     try:
-        if gcs_file_name:
-            # Method 1: Get original from GCS (Best Quality)
-            image_bytes = await vertex_service.download_from_gcs(gcs_file_name)
-            if image_bytes:
-                document_file = BufferedInputFile(image_bytes, filename="original_image.png")
-                await callback.message.answer_document(
-                    document=document_file, 
-                    caption="📥 Оригинал из Google Cloud Storage (100% качество)"
-                )
-                return
-
-        # Method 2: Fallback to Telegram servers if GCS fails or file not in GCS
         file_id = None
         if callback.message.photo:
-            file_id = callback.message.photo[-1].file_id
+            photo = callback.message.photo[-1]
+            file_id = photo.file_id
+            if photo.file_unique_id != data.get("last_image_uid"):
+                # Button under an older image: the state's GCS name belongs to another one
+                gcs_file_name = None
+            if not gcs_file_name:
+                # Upload may still be running in the background
+                gcs_file_name = await persistence.wait(photo.file_unique_id)
         
         if not file_id:
             file_id = data.get("last_image_id")
+            if not gcs_file_name:
+                gcs_file_name = await persistence.wait(data.get("last_image_uid"))
 
-        if file_id:
-            bot = callback.bot
-            file = await bot.get_file(file_id)
-            image_io = await bot.download_file(file.file_path)
-            document_file = BufferedInputFile(image_io.read(), filename="image.png")
-            await callback.message.answer_document(document=document_file, caption="📥 Файл (через Telegram)")
-        else:
-            await callback.answer("❌ Файл не найден", show_alert=True)
+        await send_original(callback, gcs_file_name, file_id)
             
     except Exception as e:
         logger.error(f"Download failed: {e}")
         await callback.answer("❌ Ошибка при скачивании", show_alert=True)
 
+async def send_original(callback: CallbackQuery, gcs_file_name: str, file_id: str):
+    if gcs_file_name:
+        caption = "📥 Оригинал из Google Cloud Storage (100% качество)"
+
+        # Method 0: Already uploaded to Telegram once, send by reference
+        document_id = document_ids.get(gcs_file_name)
+        if document_id:
+            await callback.message.answer_document(document=document_id, caption=caption)
+            return
+
+        # Method 1: Stream original from GCS (Best Quality)
+        blob = vertex_service.gcs_blob(gcs_file_name)
+        if blob is not None:
+            try:
+                result_msg = await callback.message.answer_document(
+                    document=GCSInputFile(blob, filename=f"original_image.{gcs_file_name.rsplit('.', 1)[-1]}", retry=vertex_service.retry["gcs"]),
+                    caption=caption
+                )
+                if result_msg.document:
+                    document_ids.set(gcs_file_name, result_msg.document.file_id)
+                return
+            except Exception as e:
+                logger.error(f"GCS stream of {gcs_file_name} failed: {e}")
+
+    # Method 2: Fallback to Telegram servers if GCS fails or file not in GCS
+    if file_id:
+        bot = callback.bot
+        file = await bot.get_file(file_id)
+        image_io = await bot.download_file(file.file_path)
+        document_file = BufferedInputFile(image_io.read(), filename="image.png")
+        await callback.message.answer_document(document=document_file, caption="📥 Файл (через Telegram)")
+    else:
+        await callback.answer("❌ Файл не найден", show_alert=True)
+
 @router.callback_query(F.data == "img_edit")
 async def start_image_edit(callback: CallbackQuery, state: FSMContext):
     # Store the file_id in state when user clicks 'Edit' 
     # so we know WHICH image to edit even if state was lost
     if callback.message.photo:
-        file_id = callback.message.photo[-1].file_id
-        await state.update_data(last_image_id=file_id)
+        photo = callback.message.photo[-1]
+        data = await state.get_data()
+        update = {"last_image_id": photo.file_id, "last_image_uid": photo.file_unique_id}
+        if data.get("last_image_uid") != photo.file_unique_id:
+            # An older image: the GCS original in state belongs to another one
+            update["gcs_file_name"] = None
+        await state.update_data(**update)
         
         # Also try to extract original prompt from caption if possible
         caption = callback.message.caption or ""
@@ -313,19 +394,27 @@ async def process_image_edit(message: Message, state: FSMContext):
     msg = await message.answer("🎨 Редактирую изображение...")
 
     try:
-        # Download file from Telegram
-        bot = message.bot
-        file = await bot.get_file(file_id)
-        image_io = await bot.download_file(file.file_path)
-        image_bytes = image_io.read()
+        # Memory, then the GCS original, then Telegram's recompressed copy
+        image_bytes = await working_images.fetch(
+            message.from_user.id,
+            message.bot,
+            file_id,
+            key=data.get("last_image_uid"),
+            gcs_file_name=data.get("gcs_file_name")
+        )
+
+        # Real format, no metadata, no more pixels than the model uses
+        input_bytes, mime_type = await prepare_input(image_bytes)
 
         # Call Vertex AI
-        edited_image_bytes = await vertex_service.edit_image(image_bytes, edit_prompt)
+        edited_image_bytes = await vertex_service.edit_image(
+            input_bytes, edit_prompt, mime_type=mime_type, user_id=message.from_user.id
+        )
         
-        # Save edited version to GCS
-        new_gcs_file = await vertex_service.upload_to_gcs(edited_image_bytes)
+        # Save edited version to GCS in the background
+        upload = persistence.start(edited_image_bytes)
         
-        photo_file = BufferedInputFile(edited_image_bytes, filename="edited_image.png")
+        photo_file = await make_preview(edited_image_bytes, "edited_image")
         
         await msg.delete()
         result_msg = await message.answer_photo(
@@ -335,11 +424,19 @@ async def process_image_edit(message: Message, state: FSMContext):
         )
         
         if result_msg.photo:
+            photo = result_msg.photo[-1]
+            working_images.put(message.from_user.id, edited_image_bytes, photo.file_unique_id)
+            persistence.register(upload, photo.file_unique_id)
             await state.update_data(
-                last_image_id=result_msg.photo[-1].file_id,
-                gcs_file_name=new_gcs_file
+                last_image_id=photo.file_id,
+                last_image_uid=photo.file_unique_id,
+                gcs_file_name=None
             )
+            persistence.track(upload, photo.file_unique_id, state)
             
+    except ModelBusyError as e:
+        logger.warning(f"Image edit rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
     except Exception as e:
         logger.error(f"Image edit failed: {e}", exc_info=True)
         await msg.edit_text("❌ Извините, произошла ошибка при редактировании изображения.")
@@ -348,6 +445,7 @@ async def process_image_edit(message: Message, state: FSMContext):
 
 @router.callback_query(F.data == "img_regenerate")
 async def regenerate_image(callback: CallbackQuery, state: FSMContext):
+    # Always a fresh model call: the generation cache is deliberately bypassed here
     # Try to recover prompt from state or caption
     data = await state.get_data()
     original_prompt = data.get("last_prompt")
@@ -364,13 +462,19 @@ async def regenerate_image(callback: CallbackQuery, state: FSMContext):
     await callback.answer("🔄 Генерирую заново...")
     
     user_id = callback.from_user.id
-    user_settings = get_user_settings(user_id)
+    user_settings = await get_user_settings(user_id)
     aspect_ratio = user_settings.get("aspect_ratio", "1:1")
     style = user_settings.get("style", "photo")
     magic_prompt = user_settings.get("magic_prompt", True)
     
     magic_status = "ON" if magic_prompt else "OFF"
-    msg = await callback.message.answer(f"🎨 Вариант 2...\n(AR: {aspect_ratio}, Style: {style}, Magic: {magic_status})")
+    # Several variants in parallel, but never more than the image model admits at once
+    variants = min(app_settings.IMAGE_VARIANTS, app_settings.IMAGE_CONCURRENCY)
+    if variants > 1:
+        status_text = f"🎨 Генерирую варианты ({variants} шт.)...\n(AR: {aspect_ratio}, Style: {style}, Magic: {magic_status})"
+    else:
+        status_text = f"🎨 Вариант 2...\n(AR: {aspect_ratio}, Style: {style}, Magic: {magic_status})"
+    msg = await callback.message.answer(status_text)
     
     try:
         if magic_prompt:
@@ -391,39 +495,162 @@ async def regenerate_image(callback: CallbackQuery, state: FSMContext):
                 f"In your text response, provide ONLY a very brief, one-sentence description of the image in Russian."
             )
 
-        image_bytes, model_text = await vertex_service.generate_image(full_user_prompt, aspect_ratio=aspect_ratio)
+        if variants > 1:
+            await send_variants(callback, state, msg, full_user_prompt, aspect_ratio, magic_prompt, original_prompt, variants)
+            return
+
+        image_bytes, model_text = await vertex_service.generate_image(
+            full_user_prompt, aspect_ratio=aspect_ratio, user_id=user_id
+        )
         
-        # Save to GCS
-        new_gcs_file = await vertex_service.upload_to_gcs(image_bytes)
+        # Save to GCS in the background
+        upload = persistence.start(image_bytes)
         
-        photo_file = BufferedInputFile(image_bytes, filename="image.png")
+        photo_file = await make_preview(image_bytes, "image")
         
         await msg.delete()
         
-        if magic_prompt:
-            caption_text = f"✨ Magic Prompt:\n{model_text}"
-        else:
-            caption_text = f"✨ {original_prompt}"
-
-        if len(caption_text) > 1024:
-            caption_text = caption_text[:1021] + "..."
-
         result_msg = await callback.message.answer_photo(
             photo=photo_file,
-            caption=caption_text,
+            caption=build_caption(magic_prompt, model_text, original_prompt),
             reply_markup=get_image_response_keyboard()
         )
         
         if result_msg.photo:
-            file_id = result_msg.photo[-1].file_id
+            photo = result_msg.photo[-1]
+            working_images.put(user_id, image_bytes, photo.file_unique_id)
+            persistence.register(upload, photo.file_unique_id)
             await state.update_data(
-                last_image_id=file_id,
-                gcs_file_name=new_gcs_file
+                last_image_id=photo.file_id,
+                last_image_uid=photo.file_unique_id,
+                gcs_file_name=None
             )
+            persistence.track(upload, photo.file_unique_id, state)
             
+    except ModelBusyError as e:
+        logger.warning(f"Regeneration rejected: {e}")
+        await msg.edit_text(f"🚦 Сейчас слишком много запросов (позиция в очереди: {e.position}). Попробуйте через минуту.")
     except Exception as e:
         logger.error(f"Regeneration failed: {e}", exc_info=True)
         try:
             await msg.edit_text("❌ Извините, произошла ошибка при повторной генерации.")
         except:
             pass
+
+
+async def send_variants(callback: CallbackQuery, state: FSMContext, msg: Message, full_user_prompt: str,
+                        aspect_ratio: str, magic_prompt: bool, original_prompt: str, count: int):
+    # Fan out the generations; variants that fail are dropped as long as one succeeds
+    results = await asyncio.gather(
+        *[
+            vertex_service.generate_image(
+                full_user_prompt, aspect_ratio=aspect_ratio, user_id=callback.from_user.id, variant=i
+            )
+            for i in range(count)
+        ],
+        return_exceptions=True
+    )
+    generated = [r for r in results if not isinstance(r, BaseException)]
+    if not generated:
+        raise results[0]
+    for r in results:
+        if isinstance(r, BaseException):
+            logger.warning(f"Variant generation failed: {r}")
+
+    # Parallel background uploads, overlapping with the media group send
+    uploads = [persistence.start(image_bytes) for image_bytes, _ in generated]
+
+    previews = await asyncio.gather(
+        *[make_preview(image_bytes, f"variant_{i + 1}") for i, (image_bytes, _) in enumerate(generated)]
+    )
+    media = [
+        InputMediaPhoto(
+            media=preview,
+            caption=build_caption(magic_prompt, generated[0][1], original_prompt) if i == 0 else None
+        )
+        for i, preview in enumerate(previews)
+    ]
+
+    await msg.delete()
+    sent = await callback.message.answer_media_group(media=media)
+
+    user_id = callback.from_user.id
+    variant_data = []
+    for sent_msg in sent:
+        photo = sent_msg.photo[-1]
+        variant_data.append({
+            "file_id": photo.file_id,
+            "file_uid": photo.file_unique_id,
+            "gcs_file_name": None
+        })
+
+    for upload, variant in zip(uploads, variant_data):
+        persistence.register(upload, variant["file_uid"])
+
+    first = variant_data[0]
+    set_id = uuid.uuid4().hex[:8]
+    working_images.put(user_id, generated[0][0], first["file_uid"])
+    await state.update_data(
+        variants=variant_data,
+        variants_set=set_id,
+        last_image_id=first["file_id"],
+        last_image_uid=first["file_uid"],
+        gcs_file_name=None
+    )
+
+    # Media groups can't carry buttons: one row of actions per variant
+    await callback.message.answer(
+        "Выберите вариант 👇",
+        reply_markup=get_variants_keyboard(set_id, len(variant_data))
+    )
+    for upload, variant in zip(uploads, variant_data):
+        persistence.track(upload, variant["file_uid"], state)
+
+STALE_VARIANTS = "⚠️ Этот набор вариантов устарел. Используйте кнопки под последним набором."
+
+def get_variant(data: dict, callback_data: str):
+    """Variant for a `var_*_{set_id}_{n}` button; None if the button belongs to another set."""
+    try:
+        _, set_id, number = callback_data.rsplit("_", 2)
+        number = int(number)
+    except ValueError:
+        return None
+    variants = data.get("variants") or []
+    if set_id != data.get("variants_set") or not 1 <= number <= len(variants):
+        return None
+    return variants[number - 1]
+
+@router.callback_query(F.data.startswith("var_dl_"))
+async def download_variant(callback: CallbackQuery, state: FSMContext):
+    variant = get_variant(await state.get_data(), callback.data)
+    if not variant:
+        await callback.answer(STALE_VARIANTS, show_alert=True)
+        return
+
+    await callback.answer("⏳ Скачиваю оригинал из Google Cloud...")
+    try:
+        gcs_file_name = variant["gcs_file_name"] or await persistence.wait(variant["file_uid"])
+        await send_original(callback, gcs_file_name, variant["file_id"])
+    except Exception as e:
+        logger.error(f"Variant download failed: {e}")
+        await callback.answer("❌ Ошибка при скачивании", show_alert=True)
+
+@router.callback_query(F.data.startswith("var_edit_"))
+async def edit_variant(callback: CallbackQuery, state: FSMContext):
+    variant = get_variant(await state.get_data(), callback.data)
+    if not variant:
+        await callback.answer(STALE_VARIANTS, show_alert=True)
+        return
+
+    await state.update_data(
+        last_image_id=variant["file_id"],
+        last_image_uid=variant["file_uid"],
+        gcs_file_name=variant["gcs_file_name"]
+    )
+    await state.set_state(GenStates.edit_wait)
+    await callback.message.answer(
+        "✏️ Режим редактирования\n\n"
+        "Опишите, что вы хотите изменить в этом изображении.\n"
+        "Например: 'Сделай небо красным' или 'Добавь кота на стул'."
+    )
+    await callback.answer()
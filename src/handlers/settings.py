@@ -1,14 +1,15 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from src.keyboards.settings_kbs import get_settings_keyboard
-from src.settings_store import update_user_setting, get_user_settings
+from src.settings_store import apply_user_setting, get_user_settings
+from src.utils.markup import same_markup
 
 router = Router()
 
 @router.message(F.text == "⚙️ Настройки")
 async def settings_menu(message: Message):
     user_id = message.from_user.id
-    user_settings = get_user_settings(user_id)
+    user_settings = await get_user_settings(user_id)
     
     # Update defaults if missing
     ar = user_settings.get("aspect_ratio", "1:1")
@@ -41,17 +42,18 @@ async def setting_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
     
     if action == "ar":
-        update_user_setting(user_id, "aspect_ratio", value)
-        setting_name = "Соотношение сторон"
+        key, setting_name = "aspect_ratio", "Соотношение сторон"
     elif action == "style":
-        update_user_setting(user_id, "style", value)
-        setting_name = "Стиль"
+        key, setting_name = "style", "Стиль"
     else:
         await callback.answer("Неизвестная настройка")
         return
+
+    # Answer before any I/O; the change is applied locally and written later
+    await callback.answer(f"{setting_name} изменено на {value}")
+    user_settings = await apply_user_setting(user_id, key, value)
     
     # Refresh message text to show new settings
-    user_settings = get_user_settings(user_id)
     ar = user_settings.get("aspect_ratio", "1:1")
     style = user_settings.get("style", "photo")
     magic = user_settings.get("magic_prompt", True)
@@ -64,6 +66,8 @@ async def setting_callback(callback: CallbackQuery):
         f"✨ Magic Prompt: {'Вкл' if magic else 'Выкл'}\n"
         f"📺 Разрешение: {res}"
     )
-    
-    await callback.message.edit_text(text, reply_markup=get_settings_keyboard())
-    await callback.answer(f"{setting_name} изменено на {value}")
+    markup = get_settings_keyboard()
+
+    # Re-tapping the current value changes nothing: skip the edit
+    if callback.message.text != text or not same_markup(callback.message.reply_markup, markup):
+        await callback.message.edit_text(text, reply_markup=markup)
@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from src.utils.cache import TTLCache
+from src.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+UPDATE_LATENCY = registry.histogram(
+    "update_duration_seconds", "Webhook ingress to handler completion, including queueing", ("outcome",)
+)
+
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+BUSY = "busy"
+
+def chat_key(update: Update):
+    """Key that orders updates: the chat (or user) they belong to."""
+    if update.callback_query is not None:
+        # Button presses must be answered within seconds, so they don't wait
+        # behind a long-running message of their chat
+        return ("update", update.update_id)
+    try:
+        event = update.event
+    except Exception:
+        return ("update", update.update_id)
+
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = getattr(event.message, "chat", None)
+    if chat is not None:
+        return ("chat", chat.id)
+
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return ("user", user.id)
+    return ("update", update.update_id)
+
+class UpdatePipeline:
+    """
+    Bounded ingress for webhook updates.
+
+    A fixed pool of workers feeds updates to the dispatcher. Updates of one chat
+    run strictly in arrival order, while different chats run in parallel.
+    Callback queries are not ordered and run as soon as a worker is free.
+    Redelivered update_ids are dropped, and `submit` reports BUSY instead of
+    queueing once `max_queue` updates are pending.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 32, max_queue: int = 1000,
+                 dedup_size: int = 10000, dedup_ttl: float = 3600.0):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self._seen = TTLCache(maxsize=dedup_size, ttl=dedup_ttl)
+        # chat key -> updates waiting; a key is present while the chat is queued or running
+        self._pending: dict = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+        self.queued = 0
+        self.in_flight = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def submit(self, update: Update) -> str:
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            return DUPLICATE
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            return BUSY
+
+        self._seen.set(update.update_id, True)
+        key = chat_key(update)
+        updates = self._pending.get(key)
+        if updates is None:
+            # Chat is idle: schedule it
+            updates = self._pending[key] = deque()
+            self._ready.put_nowait(key)
+        updates.append((update, time.perf_counter()))
+        self.queued += 1
+        return ACCEPTED
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            updates = self._pending[key]
+            update, received = updates.popleft()
+            self.queued -= 1
+            self.in_flight += 1
+            result = "ok"
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception as e:
+                result = "error"
+                logger.error(f"Update {update.update_id} failed: {e}", exc_info=True)
+            finally:
+                UPDATE_LATENCY.observe(time.perf_counter() - received, result)
+                self.in_flight -= 1
+                self.processed += 1
+                # One update per turn keeps busy chats from starving the others
+                if updates:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Update pipeline started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 10.0):
+        """Gives queued updates up to `timeout` seconds to finish, then cancels the workers."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (self.queued or self.in_flight) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queued,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+        }
@@ -47,3 +47,14 @@ def get_image_response_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="✏️ Редактировать", callback_data="img_edit")
     )
     return builder.as_markup()
+
+def get_variants_keyboard(set_id: str, count: int) -> InlineKeyboardMarkup:
+    # The set ID tells buttons of an older set apart from the current one
+    builder = InlineKeyboardBuilder()
+    for i in range(1, count + 1):
+        builder.row(
+            InlineKeyboardButton(text=f"📥 Скачать {i}", callback_data=f"var_dl_{set_id}_{i}"),
+            InlineKeyboardButton(text=f"✏️ Редактировать {i}", callback_data=f"var_edit_{set_id}_{i}")
+        )
+    builder.row(InlineKeyboardButton(text="🔄 Еще варианты", callback_data="img_regenerate"))
+    return builder.as_markup()
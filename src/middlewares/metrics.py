@@ -0,0 +1,35 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from src.utils.metrics import registry
+from src.services.tracing import tracer
+
+HANDLER_CALLS = registry.counter("handler_calls_total", "Handler invocations", ("handler", "outcome"))
+HANDLER_SECONDS = registry.histogram("handler_duration_seconds", "Handler execution time", ("handler",))
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware: runs only once a handler has matched, so the handler's
+    name is known. Registered on the dispatcher, it covers all child routers.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            with tracer.span("handler", handler=name):
+                return await handler(event, data)
+        except Exception:
+            result = "error"
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            HANDLER_CALLS.inc(name, result)
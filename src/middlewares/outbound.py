@@ -0,0 +1,316 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    TelegramMethod, SendMessage, SendPhoto, SendDocument, SendMediaGroup, SendAnimation,
+    SendVideo, SendAudio, SendVoice, SendSticker, CopyMessage, ForwardMessage,
+    EditMessageText, EditMessageCaption, EditMessageReplyMarkup, EditMessageMedia, DeleteMessage
+)
+from src.config import settings
+from src.middlewares.throttling import TokenBucket
+from src.services.streaming import split_text, TELEGRAM_TEXT_LIMIT
+from src.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_WAIT = registry.histogram("outbound_wait_seconds", "Time a Telegram request waited for its turn", ("kind",))
+OUTBOUND_EVENTS = registry.counter("outbound_events_total", "Outbound scheduler events", ("event",))
+
+# Lower goes first
+INTERACTIVE = 0
+STATUS = 1
+BULK = 2
+
+KIND_NAMES = {INTERACTIVE: "interactive", STATUS: "status", BULK: "bulk"}
+
+SENDS = (
+    SendMessage, SendPhoto, SendDocument, SendMediaGroup, SendAnimation, SendVideo,
+    SendAudio, SendVoice, SendSticker, CopyMessage, ForwardMessage
+)
+EDITS = (EditMessageText, EditMessageCaption, EditMessageReplyMarkup, EditMessageMedia)
+
+_priority: ContextVar[Optional[int]] = ContextVar("outbound_priority", default=None)
+
+@contextmanager
+def bulk():
+    """Requests made inside go after interactive replies and status edits (broadcasts)."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class _Outgoing:
+    __slots__ = ("order", "priority", "chat_id", "key", "make_request", "bot", "method", "waiters", "queued", "retries")
+
+    def __init__(self, order: int, priority: int, chat_id, key, make_request, bot: Bot, method: TelegramMethod):
+        self.order = order
+        self.priority = priority
+        self.chat_id = chat_id
+        self.key = key
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.waiters: list[asyncio.Future] = [asyncio.get_running_loop().create_future()]
+        self.queued = time.monotonic()
+        self.retries = 0
+
+class _ChatState:
+    __slots__ = ("bucket", "paused_until")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.paused_until = 0.0
+
+def _wait_for_token(bucket: TokenBucket, now: float) -> float:
+    """Seconds until `bucket` has a token, without consuming it."""
+    tokens = min(bucket.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+    return 0.0 if tokens >= 1 else (1 - tokens) / bucket.rate
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """
+    Session middleware that paces messages sent by the bot.
+
+    Sends and edits wait for a token from a global bucket and from the bucket
+    of their chat (group chats get a slower one). Among requests that may go,
+    interactive replies are sent before status edits and deletes, and those
+    before broadcast messages (see `bulk`). A queued edit of a message is
+    replaced by a newer edit of the same message; both callers get the result.
+
+    A RetryAfter pauses the chat and puts the request back in the queue, so
+    handlers don't see flood control unless it persists for `max_retries`.
+    Plain text over 4096 characters is sent as several messages.
+    Other methods (callback answers, getFile, ...) are not queued.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, group_rate: float = 0.33,
+                 chat_burst: int = 3, max_retries: int = 5, idle_ttl: float = 60.0):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.idle_ttl = max(idle_ttl, chat_burst / min(chat_rate, group_rate))
+        self._chats: "OrderedDict[object, _ChatState]" = OrderedDict()
+        self._pending: list[_Outgoing] = []
+        self._edits: dict[tuple, _Outgoing] = {}
+        self._in_flight: set[asyncio.Task] = set()
+        self._order = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "in_flight": len(self._in_flight), "chats": len(self._chats)}
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not isinstance(method, SENDS + EDITS + (DeleteMessage,)):
+            return await self._call_direct(make_request, bot, method)
+
+        priority = _priority.get()
+        if priority is None:
+            priority = INTERACTIVE if isinstance(method, SENDS) else STATUS
+
+        parts = self._split(bot, method)
+        if parts is None:
+            return await self._submit(make_request, bot, method, priority)
+
+        OUTBOUND_EVENTS.inc("split")
+        # The caller gets the first message: the one it sent or edited
+        result = await self._submit(make_request, bot, parts[0], priority)
+        for part in parts[1:]:
+            await self._submit(make_request, bot, part, priority)
+        return result
+
+    async def _call_direct(self, make_request, bot: Bot, method: TelegramMethod):
+        retries = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                OUTBOUND_EVENTS.inc("retry_after")
+                await asyncio.sleep(e.retry_after)
+
+    def _split(self, bot: Bot, method: TelegramMethod) -> Optional[list[TelegramMethod]]:
+        if not isinstance(method, (SendMessage, EditMessageText)) or len(method.text) <= TELEGRAM_TEXT_LIMIT:
+            return None
+        parse_mode = method.parse_mode
+        if isinstance(parse_mode, Default):
+            parse_mode = bot.default[parse_mode.name]
+        if method.entities or parse_mode:
+            # Cutting through markup would break it; leave the error to Telegram
+            return None
+
+        chunks = split_text(method.text)
+        parts = [method.model_copy(update={"text": chunks[0], "reply_markup": None})]
+        for chunk in chunks[1:]:
+            if isinstance(method, SendMessage):
+                parts.append(method.model_copy(update={
+                    "text": chunk, "reply_markup": None, "reply_parameters": None, "reply_to_message_id": None
+                }))
+            else:
+                parts.append(SendMessage(chat_id=method.chat_id, text=chunk))
+        # Buttons go under the end of the text
+        parts[-1] = parts[-1].model_copy(update={"reply_markup": method.reply_markup})
+        return parts
+
+    async def _submit(self, make_request, bot: Bot, method: TelegramMethod, priority: int):
+        self._order += 1
+        key = None
+        if isinstance(method, EDITS):
+            key = (type(method).__name__, method.chat_id, method.message_id)
+        item = _Outgoing(self._order, priority, method.chat_id, key, make_request, bot, method)
+        future = item.waiters[0]
+        self._ensure_running()
+        self._enqueue(item)
+        return await future
+
+    def _enqueue(self, item: _Outgoing):
+        older = self._edits.get(item.key) if item.key is not None else None
+        if older is not None:
+            # Only the latest state of the message matters
+            if item.order > older.order:
+                older.method, older.make_request, older.bot = item.method, item.make_request, item.bot
+            older.waiters.extend(item.waiters)
+            older.order = min(older.order, item.order)
+            OUTBOUND_EVENTS.inc("superseded")
+        else:
+            self._pending.append(item)
+            if item.key is not None:
+                self._edits[item.key] = item
+        self._wakeup.set()
+
+    def _ensure_running(self):
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._runner = asyncio.create_task(self._run())
+
+    def _chat(self, chat_id, now: float) -> _ChatState:
+        # Least recently used first, so stop at the first fresh state
+        while self._chats:
+            key, state = next(iter(self._chats.items()))
+            if now - state.bucket.updated < self.idle_ttl or state.paused_until > now:
+                break
+            del self._chats[key]
+
+        state = self._chats.get(chat_id)
+        if state is None:
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            state = self._chats[chat_id] = _ChatState(TokenBucket(rate, self.chat_burst, now))
+        return state
+
+    def _pick(self, now: float) -> tuple[Optional[_Outgoing], Optional[float]]:
+        """The request to send now, or how long to wait before looking again (None: until woken)."""
+        self._pending = [item for item in self._pending if not self._abandoned(item)]
+        if not self._pending:
+            return None, None
+        wait = _wait_for_token(self.global_bucket, now)
+        if wait > 0:
+            return None, wait
+
+        best, wait = None, None
+        for item in self._pending:
+            state = self._chat(item.chat_id, now)
+            chat_wait = max(state.paused_until - now, _wait_for_token(state.bucket, now))
+            if chat_wait <= 0:
+                if best is None or (item.priority, item.order) < (best.priority, best.order):
+                    best = item
+            elif wait is None or chat_wait < wait:
+                wait = chat_wait
+        return best, wait
+
+    def _abandoned(self, item: _Outgoing) -> bool:
+        # Every caller was cancelled while the request was queued
+        if all(waiter.done() for waiter in item.waiters):
+            if self._edits.get(item.key) is item:
+                del self._edits[item.key]
+            return True
+        return False
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            item, wait = self._pick(now)
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(item)
+            if self._edits.get(item.key) is item:
+                del self._edits[item.key]
+            state = self._chat(item.chat_id, now)
+            state.bucket.consume(now)
+            self._chats.move_to_end(item.chat_id)
+            self.global_bucket.consume(now)
+            OUTBOUND_WAIT.observe(now - item.queued, KIND_NAMES[item.priority])
+
+            task = asyncio.create_task(self._send(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, item: _Outgoing):
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            item.retries += 1
+            if item.retries > self.max_retries:
+                self._resolve(item, error=e)
+                return
+            OUTBOUND_EVENTS.inc("retry_after")
+            logger.warning(f"Telegram flood control for chat {item.chat_id}: retry in {e.retry_after}s")
+            state = self._chat(item.chat_id, time.monotonic())
+            state.paused_until = max(state.paused_until, time.monotonic() + e.retry_after)
+            self._enqueue(item)
+        except Exception as e:
+            self._resolve(item, error=e)
+        else:
+            self._resolve(item, result=result)
+
+    @staticmethod
+    def _resolve(item: _Outgoing, result=None, error: Exception = None):
+        for waiter in item.waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(result)
+
+    async def close(self):
+        """Stops dispatching; requests still queued are cancelled."""
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        for item in self._pending:
+            for waiter in item.waiters:
+                waiter.cancel()
+        self._pending.clear()
+        self._edits.clear()
+
+outbound_scheduler = OutboundScheduler(
+    global_rate=settings.OUTBOUND_GLOBAL_RATE,
+    chat_rate=settings.OUTBOUND_CHAT_RATE,
+    group_rate=settings.OUTBOUND_GROUP_RATE,
+    chat_burst=settings.OUTBOUND_CHAT_BURST,
+    max_retries=settings.OUTBOUND_MAX_RETRIES
+)
@@ -1,45 +1,90 @@
 import time
-import asyncio
-from typing import Any, Awaitable, Callable, Dict
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject, User
+from aiogram.types import TelegramObject, User, CallbackQuery
 import logging
 
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
 class RateLimitMiddleware(BaseMiddleware):
-    def __init__(self, limit: float = 1.0):
-        self.limit = limit
-        self.last_user_time: Dict[int, float] = {}
+    """
+    Token-bucket throttling with a bucket per user plus an optional global bucket
+    (which can be shared between several middleware instances).
+    Buckets of users idle for `idle_ttl` seconds are evicted, so memory is bounded
+    by the number of recently active users.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 1, global_bucket: Optional[TokenBucket] = None,
+                 idle_ttl: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.global_bucket = global_bucket
+        # An evicted bucket would have refilled to full by now anyway
+        self.idle_ttl = max(idle_ttl, burst / rate)
+        self.buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.dropped = 0
         super().__init__()
 
+    def _evict_idle(self, now: float):
+        # Least recently used first, so stop at the first fresh bucket
+        while self.buckets:
+            user_id, bucket = next(iter(self.buckets.items()))
+            if now - bucket.updated < self.idle_ttl:
+                break
+            del self.buckets[user_id]
+
+    def allow(self, user_id: int, now: float) -> bool:
+        self._evict_idle(now)
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst, now)
+        else:
+            self.buckets.move_to_end(user_id)
+
+        if not bucket.consume(now):
+            return False
+        if self.global_bucket is not None and not self.global_bucket.consume(now):
+            return False
+        return True
+
     async def __call__(
         self,
         handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
         event: TelegramObject,
         data: Dict[str, Any]
     ) -> Any:
-        # Check if event is a CallbackQuery (buttons) - do not throttle these
-        # as rapid button clicks are common and should be handled gracefully
-        # or let the handler deal with concurrency.
-        try:
-            if hasattr(event, 'callback_query') or 'callback_query' in str(event):
-                return await handler(event, data)
-        except:
-            pass
-            
         user: User = data.get("event_from_user")
-        
-        if user:
-            user_id = user.id
-            current_time = time.time()
-            
-            if user_id in self.last_user_time:
-                elapsed = current_time - self.last_user_time[user_id]
-                if elapsed < self.limit:
-                    # Too fast! Silent ignore (standard Telegram bot behavior)
-                    return
-            
-            self.last_user_time[user_id] = current_time
-            
+
+        if user and not self.allow(user.id, time.monotonic()):
+            self.dropped += 1
+            if isinstance(event, CallbackQuery):
+                # Stop the button spinner even though the click is ignored
+                try:
+                    await event.answer()
+                except Exception:
+                    pass
+            # Too fast! Silent ignore (standard Telegram bot behavior)
+            return
+
         return await handler(event, data)
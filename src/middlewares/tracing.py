@@ -0,0 +1,23 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from src.services.tracing import tracer
+
+class TracingMiddleware(BaseMiddleware):
+    """Outer update middleware: opens the root span of each update's trace."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        attrs = {}
+        if isinstance(event, Update):
+            attrs["update_id"] = event.update_id
+            attrs["event_type"] = event.event_type
+        user = data.get("event_from_user")
+        if user:
+            attrs["user_id"] = user.id
+        with tracer.trace("update", **attrs):
+            return await handler(event, data)
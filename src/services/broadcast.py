@@ -0,0 +1,306 @@
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest,
+    TelegramNetworkError, TelegramServerError
+)
+from google.cloud import firestore
+from src.config import settings
+from src.middlewares.throttling import TokenBucket
+from src.middlewares.outbound import bulk
+from src.settings_store import get_async_db, firestore_retry, iter_user_ids
+from src.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_MESSAGES = registry.counter("broadcast_messages_total", "Broadcast deliveries", ("result",))
+
+# Network / 5xx errors are retried this many times per recipient
+MAX_SEND_ATTEMPTS = 4
+# A run interrupted by an error resumes from its checkpoint this many times before the job fails
+MAX_RUN_ATTEMPTS = 3
+RUN_RETRY_DELAY = 5.0
+
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+@dataclass
+class BroadcastJob:
+    job_id: str
+    text: Optional[str] = None             # plain text, or
+    from_chat_id: Optional[int] = None     # a message to copy
+    message_id: Optional[int] = None
+    status: str = RUNNING
+    cursor: Optional[str] = None           # every user up to this ID has been handled
+    sent: int = 0
+    blocked: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.time)
+    rate: float = 0.0                      # messages/s over the current run
+    lease_until: float = 0.0
+
+    @property
+    def handled(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+class Broadcaster:
+    """
+    Sends one message to every user in `user_settings`.
+
+    Recipients are read page by page with Firestore cursors into a bounded queue,
+    so memory doesn't grow with the number of users. Sends are paced by a global
+    token bucket (each chat gets a single message, so per-chat limits hold), and
+    a RetryAfter from Telegram pauses all workers for the requested time.
+
+    Progress is checkpointed in `broadcasts/{job_id}` each time a page is fully
+    handled. A run interrupted by an error resumes from the checkpoint in this
+    process up to MAX_RUN_ATTEMPTS times, then the job is marked failed. A job
+    whose lease has expired (its instance died) is picked up again by
+    `resume_pending`. Either way recipients of the unfinished page may get the
+    message twice. Only jobs still running are kept in `jobs`.
+    """
+
+    def __init__(self, client_factory, collection: str = "broadcasts", rate: float = 20.0,
+                 workers: int = 16, page_size: int = 500, lease: float = 120.0,
+                 progress_interval: float = 30.0):
+        self.client_factory = client_factory
+        self.collection = collection
+        self.rate = rate
+        self.workers = workers
+        self.page_size = page_size
+        self.lease = lease
+        self.progress_interval = progress_interval
+        self.bucket = TokenBucket(rate, max(1, rate))
+        self._paused_until = 0.0
+        self.jobs: dict[str, BroadcastJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def _doc(self, job_id: str):
+        return self.client.collection(self.collection).document(job_id)
+
+    async def _checkpoint(self, job: BroadcastJob):
+        if self.client is None:
+            return
+        job.lease_until = time.time() + self.lease
+        try:
+            await firestore_retry.call(self._doc(job.job_id).set, asdict(job))
+        except Exception as e:
+            logger.error(f"Broadcast {job.job_id} checkpoint failed: {e}")
+
+    def _spawn(self, bot: Bot, job: BroadcastJob):
+        self.jobs[job.job_id] = job
+        task = asyncio.create_task(self._run(bot, job))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+
+    async def start(self, bot: Bot, text: str = None, from_chat_id: int = None, message_id: int = None) -> BroadcastJob:
+        job = BroadcastJob(job_id=uuid.uuid4().hex[:12], text=text, from_chat_id=from_chat_id, message_id=message_id)
+        await self._checkpoint(job)
+        self._spawn(bot, job)
+        logger.info(f"Broadcast {job.job_id} started")
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[BroadcastJob]:
+        """A job running here, or the last checkpoint of any job."""
+        job = self.jobs.get(job_id)
+        if job is not None or not job_id or self.client is None:
+            return job
+        try:
+            snapshot = await firestore_retry.call(self._doc(job_id).get)
+        except Exception as e:
+            logger.error(f"Could not read broadcast {job_id}: {e}")
+            return None
+        return BroadcastJob(**snapshot.to_dict()) if snapshot.exists else None
+
+    async def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        task = self._tasks.get(job_id)
+        if job is None or task is None:
+            return False
+        job.status = CANCELLED
+        task.cancel()
+        await self._checkpoint(job)
+        return True
+
+    async def _claim(self, job_id: str) -> Optional[BroadcastJob]:
+        """Takes over a running job whose lease expired; None if another instance holds it."""
+        ref = self._doc(job_id)
+
+        @firestore.async_transactional
+        async def _txn(transaction):
+            snapshot = await ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = BroadcastJob(**snapshot.to_dict())
+            if job.status != RUNNING or job.lease_until > time.time():
+                return None
+            job.lease_until = time.time() + self.lease
+            transaction.set(ref, asdict(job))
+            return job
+
+        return await firestore_retry.call(lambda: _txn(self.client.transaction()))
+
+    async def resume_pending(self, bot: Bot):
+        """Resumes jobs left running by instances that stopped; call on startup."""
+        if self.client is None:
+            return
+        try:
+            query = self.client.collection(self.collection).where(
+                filter=firestore.FieldFilter("status", "==", RUNNING)
+            ).select([])
+            for snapshot in await firestore_retry.call(query.get):
+                if snapshot.id in self.jobs:
+                    continue
+                job = await self._claim(snapshot.id)
+                if job:
+                    logger.info(f"Resuming broadcast {job.job_id} after {job.cursor} ({job.handled} handled)")
+                    self._spawn(bot, job)
+        except Exception as e:
+            logger.error(f"Could not resume broadcasts: {e}")
+
+    async def _pace(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self.bucket.consume(now):
+                return
+            await asyncio.sleep(1 / self.rate)
+
+    async def _deliver(self, bot: Bot, job: BroadcastJob, chat_id: int) -> str:
+        attempt = 0
+        while True:
+            await self._pace()
+            try:
+                # Interactive replies go first when the send scheduler is busy
+                with bulk():
+                    if job.message_id:
+                        await bot.copy_message(chat_id=chat_id, from_chat_id=job.from_chat_id, message_id=job.message_id)
+                    else:
+                        await bot.send_message(chat_id=chat_id, text=job.text)
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot: pause every worker
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Broadcast {job.job_id}: RetryAfter {e.retry_after}s")
+                continue
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                logger.info(f"Broadcast {job.job_id}: {chat_id} skipped: {e}")
+                return "failed"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt >= MAX_SEND_ATTEMPTS:
+                    logger.warning(f"Broadcast {job.job_id}: {chat_id} failed: {e}")
+                    break
+                await asyncio.sleep(attempt)
+            except Exception as e:
+                logger.error(f"Broadcast {job.job_id}: unexpected error for {chat_id}: {e}")
+                break
+        return "failed"
+
+    async def _run(self, bot: Bot, job: BroadcastJob):
+        try:
+            for attempt in range(1, MAX_RUN_ATTEMPTS + 1):
+                try:
+                    await self._run_once(bot, job)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if attempt == MAX_RUN_ATTEMPTS:
+                        logger.error(f"Broadcast {job.job_id} failed after {attempt} attempts: {e}", exc_info=True)
+                        job.status = FAILED
+                        await self._checkpoint(job)
+                        return
+                    logger.warning(f"Broadcast {job.job_id} interrupted, resuming after {job.cursor}: {e}")
+                    # Also renews the lease, so no other instance claims the job meanwhile
+                    await self._checkpoint(job)
+                    await asyncio.sleep(RUN_RETRY_DELAY * attempt)
+        finally:
+            self.jobs.pop(job.job_id, None)
+
+    async def _run_once(self, bot: Bot, job: BroadcastJob):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_size)
+        # page number -> [last user ID of the page, recipients not yet handled]
+        pages: dict[int, list] = {}
+        next_page = 0
+        run_started, run_base = time.monotonic(), job.handled
+
+        async def produce():
+            page_no = 0
+            async for ids in iter_user_ids(self.page_size, start_after=job.cursor):
+                pages[page_no] = [ids[-1], len(ids)]
+                for user_id in ids:
+                    await queue.put((page_no, int(user_id)))
+                page_no += 1
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        async def work():
+            nonlocal next_page
+            while (item := await queue.get()) is not None:
+                page_no, chat_id = item
+                result = await self._deliver(bot, job, chat_id)
+                setattr(job, result, getattr(job, result) + 1)
+                BROADCAST_MESSAGES.inc(result)
+
+                pages[page_no][1] -= 1
+                # Checkpoint only past pages handled completely, in order
+                advanced = False
+                while next_page in pages and pages[next_page][1] == 0:
+                    job.cursor = pages.pop(next_page)[0]
+                    next_page += 1
+                    advanced = True
+                if advanced:
+                    await self._checkpoint(job)
+
+        async def report():
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                job.rate = (job.handled - run_base) / (time.monotonic() - run_started)
+                logger.info(
+                    f"Broadcast {job.job_id}: sent={job.sent} blocked={job.blocked} "
+                    f"failed={job.failed} ({job.rate:.1f} msg/s)"
+                )
+                # Also renews the lease while a page takes long
+                await self._checkpoint(job)
+
+        reporter = asyncio.create_task(report())
+        workers = [asyncio.create_task(work()) for _ in range(self.workers)]
+        try:
+            await produce()
+            await asyncio.gather(*workers)
+            job.status = DONE
+        finally:
+            for task in workers:
+                task.cancel()
+            reporter.cancel()
+            job.rate = (job.handled - run_base) / max(time.monotonic() - run_started, 1e-9)
+
+        await self._checkpoint(job)
+        logger.info(
+            f"Broadcast {job.job_id} finished: sent={job.sent} blocked={job.blocked} "
+            f"failed={job.failed}, {job.rate:.1f} msg/s"
+        )
+
+broadcaster = Broadcaster(
+    get_async_db,
+    rate=settings.BROADCAST_RATE,
+    workers=settings.BROADCAST_WORKERS,
+    page_size=settings.BROADCAST_PAGE_SIZE,
+    lease=settings.BROADCAST_LEASE
+)
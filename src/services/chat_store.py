@@ -0,0 +1,293 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from vertexai.generative_models import Content, Part
+from src.config import settings
+from src.settings_store import get_async_db, firestore_retry
+from src.services.vertex_ai import vertex_service
+
+logger = logging.getLogger(__name__)
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for use as context in later turns. "
+    "Keep facts, names, decisions, user preferences and open questions; drop small talk. "
+    "Write in the language of the conversation, under 200 words, plain text only.\n\n"
+    "{previous}"
+    "Conversation:\n{turns}"
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local estimate (~3 characters per token for mixed Cyrillic/Latin text)."""
+    return len(text) // 3 + 1
+
+def _message_tokens(message: dict) -> int:
+    return sum(estimate_tokens(str(p)) for p in message["parts"])
+
+async def summarize_turns(previous: str, turns: list) -> str:
+    """Folds `turns` into the rolling summary with the flash model."""
+    transcript = "\n".join(
+        f"{'User' if t['role'] == 'user' else 'Assistant'}: {' '.join(str(p) for p in t['parts'])}"
+        for t in turns
+    )
+    prompt = SUMMARY_PROMPT.format(
+        previous=f"Summary so far:\n{previous}\n\n" if previous else "",
+        turns=transcript
+    )
+    return (await vertex_service.generate_text(prompt, model_type="flash")).strip()
+
+@dataclass
+class ChatContext:
+    raw_history: list              # [{"role", "parts"}], as stored in Firestore
+    history: list                  # the same turns as Vertex `Content`
+    summary: str = ""              # rolling summary of turns folded out of raw_history
+
+class ConversationStore:
+    """
+    Per-user chat history kept in memory as ready-built Vertex `Content` objects.
+    Firestore is read only on a cache miss; changes are flushed in the background
+    in batches (write-behind), so the reply path never waits for a write.
+
+    The prompt gets the newest turns that fit the model's token budget, preceded
+    by a rolling summary. Once the history outgrows the budget, the oldest turns
+    are folded into that summary in the background, after the reply is sent.
+    """
+
+    def __init__(self, client_factory, collection: str = "chat_contexts", maxsize: int = 5000,
+                 history_limit: int = 40, flush_interval: float = 5.0, budgets: dict = None,
+                 summarize=None):
+        self.client_factory = client_factory
+        self.collection = collection
+        self.maxsize = maxsize
+        self.history_limit = history_limit
+        self.flush_interval = flush_interval
+        # model type -> token budget for summary + history
+        self.budgets = budgets or {"flash": 6000}
+        self.summarize = summarize
+        self._cache: "OrderedDict[int, ChatContext]" = OrderedDict()
+        # user_id -> document snapshot ({"history", "summary"}) waiting to be persisted
+        self._dirty: dict[int, dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._summary_tasks: dict[int, asyncio.Task] = {}
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def _doc(self, user_id: int):
+        return self.client.collection(self.collection).document(str(user_id))
+
+    @staticmethod
+    def _to_contents(raw_history: list) -> list:
+        return [
+            Content(role=h["role"], parts=[Part.from_text(str(p)) for p in h["parts"]])
+            for h in raw_history
+        ]
+
+    def _remember(self, user_id: int, context: ChatContext):
+        self._cache[user_id] = context
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            # Dirty entries stay in self._dirty until flushed, eviction loses nothing
+            self._cache.popitem(last=False)
+
+    def _mark_dirty(self, user_id: int, context: ChatContext):
+        self._dirty[user_id] = {"history": list(context.raw_history), "summary": context.summary}
+        self._ensure_flusher()
+
+    async def _load(self, user_id: int) -> ChatContext:
+        doc_data = self._dirty.get(user_id)
+        if doc_data is None:
+            doc_data = {}
+            if self.client is not None:
+                try:
+                    doc = await firestore_retry.call(self._doc(user_id).get)
+                    if doc.exists:
+                        doc_data = doc.to_dict()
+                except Exception as e:
+                    logger.error(f"Error loading chat context for {user_id}: {e}")
+
+        raw_history = list(doc_data.get("history", []))
+        try:
+            history = self._to_contents(raw_history)
+        except Exception as e:
+            logger.error(f"History conversion error: {e}")
+            raw_history, history = [], []
+
+        context = ChatContext(raw_history, history, doc_data.get("summary", ""))
+        self._remember(user_id, context)
+        return context
+
+    def _budget(self, model_type: str) -> int:
+        return self.budgets.get(model_type, min(self.budgets.values()))
+
+    async def get_history(self, user_id: int, model_type: str = "flash") -> list:
+        """
+        Returns a new list of `Content` (ChatSession appends to the list it gets):
+        the summary, then the newest turns that fit the model's token budget.
+        """
+        context = self._cache.get(user_id)
+        if context is None:
+            context = await self._load(user_id)
+        else:
+            self._cache.move_to_end(user_id)
+
+        budget = self._budget(model_type) - (estimate_tokens(context.summary) if context.summary else 0)
+        start = len(context.raw_history)
+        # Walk back whole user/model pairs so the history starts with a user turn
+        while start >= 2:
+            cost = _message_tokens(context.raw_history[start - 2]) + _message_tokens(context.raw_history[start - 1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 2
+
+        history = list(context.history[start:])
+        if context.summary:
+            history = [
+                Content(role="user", parts=[Part.from_text(f"Краткое содержание предыдущего разговора:\n{context.summary}")]),
+                Content(role="model", parts=[Part.from_text("Понял, продолжаем с учетом этого.")]),
+            ] + history
+        return history
+
+    async def append(self, user_id: int, user_text: str, model_text: str):
+        """Records a finished turn and schedules it for persistence."""
+        context = self._cache.get(user_id)
+        if context is None:
+            # Evicted while the reply was generated: the turn goes after the stored
+            # history, which the flush would otherwise overwrite
+            context = await self._load(user_id)
+
+        turn = [
+            {"role": "user", "parts": [user_text]},
+            {"role": "model", "parts": [model_text]},
+        ]
+        # Hard cap for when summarization is off or keeps failing
+        context.raw_history = (context.raw_history + turn)[-self.history_limit:]
+        context.history = (context.history + [
+            Content(role="user", parts=[Part.from_text(user_text)]),
+            Content(role="model", parts=[Part.from_text(model_text)]),
+        ])[-self.history_limit:]
+
+        self._remember(user_id, context)
+        self._mark_dirty(user_id, context)
+
+    def summarize_later(self, user_id: int, model_type: str = "flash"):
+        """
+        Folds the oldest turns into the summary in the background once the
+        history outgrows the model's budget. Call after the reply is sent.
+        """
+        context = self._cache.get(user_id)
+        if context is None or self.summarize is None or user_id in self._summary_tasks:
+            return
+        budget = self._budget(model_type)
+        total = sum(_message_tokens(m) for m in context.raw_history) + estimate_tokens(context.summary)
+        if total <= budget:
+            return
+        task = asyncio.create_task(self._fold(user_id, budget))
+        self._summary_tasks[user_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(user_id, None))
+
+    async def _fold(self, user_id: int, budget: int):
+        context = self._cache.get(user_id)
+        if context is None:
+            return
+
+        # Keep the newest pairs within half the budget, so folding doesn't run every turn
+        keep, kept_tokens = len(context.raw_history), 0
+        while keep >= 2:
+            cost = _message_tokens(context.raw_history[keep - 2]) + _message_tokens(context.raw_history[keep - 1])
+            if kept_tokens + cost > budget // 2:
+                break
+            kept_tokens += cost
+            keep -= 2
+        folded = context.raw_history[:keep]
+        if not folded:
+            return
+
+        try:
+            summary = await self.summarize(context.summary, folded)
+        except Exception as e:
+            logger.error(f"Chat summarization failed for {user_id}: {e}")
+            return
+        if not summary:
+            return
+
+        # The history may have changed meanwhile: apply only if the folded turns are still its head
+        current = self._cache.get(user_id)
+        if current is not context or context.raw_history[:len(folded)] != folded:
+            logger.info(f"Chat context of {user_id} changed during summarization, result dropped")
+            return
+        context.raw_history = context.raw_history[len(folded):]
+        context.history = context.history[len(folded):]
+        context.summary = summary
+        self._mark_dirty(user_id, context)
+        logger.info(f"Folded {len(folded)} messages of {user_id} into the chat summary")
+
+    async def clear(self, user_id: int):
+        self._cache.pop(user_id, None)
+        self._dirty.pop(user_id, None)
+        task = self._summary_tasks.pop(user_id, None)
+        if task:
+            task.cancel()
+        if self.client is None:
+            return
+        # Don't let an in-flight flush resurrect the deleted document
+        async with self._flush_lock:
+            try:
+                await firestore_retry.call(self._doc(user_id).delete)
+            except Exception as e:
+                logger.error(f"Error clearing chat context for {user_id}: {e}")
+
+    def _ensure_flusher(self):
+        if self.client is None or (self._flush_task and not self._flush_task.done()):
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            # Cancelling the loop (close) must not drop the histories taken out of _dirty
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Writes all pending histories to Firestore in batches; waits for a flush under way."""
+        if self.client is None:
+            return
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            pending, self._dirty = self._dirty, {}
+            items = list(pending.items())
+            for i in range(0, len(items), MAX_BATCH_WRITES):
+                chunk = items[i:i + MAX_BATCH_WRITES]
+                batch = self.client.batch()
+                for user_id, doc_data in chunk:
+                    batch.set(self._doc(user_id), doc_data)
+                try:
+                    await firestore_retry.call(batch.commit)
+                    logger.info(f"Flushed {len(chunk)} chat contexts to Firestore")
+                except Exception as e:
+                    logger.error(f"Chat context flush failed: {e}")
+                    # Re-queue unless a newer snapshot arrived meanwhile
+                    for user_id, doc_data in chunk:
+                        self._dirty.setdefault(user_id, doc_data)
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+conversation_store = ConversationStore(
+    get_async_db,
+    maxsize=settings.CHAT_CACHE_SIZE,
+    history_limit=settings.CHAT_HISTORY_LIMIT,
+    flush_interval=settings.CHAT_FLUSH_INTERVAL,
+    budgets={"flash": settings.FLASH_HISTORY_TOKENS, "pro": settings.PRO_HISTORY_TOKENS},
+    summarize=summarize_turns if settings.CHAT_SUMMARIZE else None
+)
@@ -0,0 +1,49 @@
+import time
+import asyncio
+import logging
+from typing import AsyncGenerator
+from aiogram import Bot
+from aiogram.types import InputFile
+from src.config import settings
+from src.utils.cache import TTLCache
+from src.services.vertex_ai import GCS_TRANSFER_SECONDS, GCS_TRANSFER_BYTES
+from src.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# GCS reader buffers whole chunks; must be a multiple of 256 KiB
+GCS_CHUNK_SIZE = 1024 * 1024
+
+class GCSInputFile(InputFile):
+    """
+    Streams a GCS object into a Telegram upload chunk by chunk,
+    so the whole original is never held in memory.
+    """
+
+    def __init__(self, blob, filename: str = None, chunk_size: int = GCS_CHUNK_SIZE, retry=None):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.blob = blob
+        self.retry = retry
+        self.bytes_sent = 0
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        started = time.perf_counter()
+        if self.retry:
+            reader = await self.retry.call(asyncio.to_thread, self.blob.open, "rb", chunk_size=self.chunk_size)
+        else:
+            reader = await asyncio.to_thread(self.blob.open, "rb", chunk_size=self.chunk_size)
+        try:
+            # Async generator: record the span without making it current
+            with tracer.span("gcs.stream", activate=False, file=self.blob.name) as span:
+                while chunk := await asyncio.to_thread(reader.read, self.chunk_size):
+                    self.bytes_sent += len(chunk)
+                    yield chunk
+                if span:
+                    span.set(bytes=self.bytes_sent)
+        finally:
+            await asyncio.to_thread(reader.close)
+            GCS_TRANSFER_SECONDS.observe(time.perf_counter() - started, "stream")
+            GCS_TRANSFER_BYTES.inc("stream", amount=self.bytes_sent)
+
+# GCS object name -> Telegram document file_id of an earlier upload
+document_ids = TTLCache(maxsize=settings.DOCUMENT_ID_CACHE_SIZE, ttl=None)
@@ -0,0 +1,47 @@
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from src.config import settings
+from src.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CachedGeneration:
+    file_id: str                   # Telegram photo file_id, resendable by reference
+    gcs_file_name: Optional[str]   # lossless original in GCS
+    model_text: str                # model's caption / magic prompt
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split()).casefold()
+
+def generation_key(prompt: str, aspect_ratio: str, style: str, magic_prompt: bool, resolution: str) -> str:
+    """Content address of a generation request: hash of the normalized prompt and settings."""
+    payload = json.dumps(
+        [normalize_prompt(prompt), aspect_ratio, style, bool(magic_prompt), resolution],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class GenerationCache:
+    """Maps generation keys to already delivered images, bounded by size and TTL."""
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 86400.0):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedGeneration]:
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: CachedGeneration):
+        self.cache.set(key, entry)
+
+generation_cache = GenerationCache(maxsize=settings.GEN_CACHE_SIZE, ttl=settings.GEN_CACHE_TTL)
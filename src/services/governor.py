@@ -0,0 +1,120 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class ModelBusyError(Exception):
+    """Raised instead of queueing when a model's wait queue is full."""
+
+    def __init__(self, model: str, position: int):
+        self.model = model
+        self.position = position
+        super().__init__(f"Model '{model}' is busy, queue position {position}")
+
+class ModelLimiter:
+    """
+    Admission control for one model: at most `concurrency` calls in flight,
+    started no faster than `rate` per second (token bucket with `burst`),
+    and at most `max_queue` callers waiting for a slot.
+    """
+
+    def __init__(self, name: str, concurrency: int, rate: float, burst: int, max_queue: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket_lock = asyncio.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def _take_token(self):
+        async with self._bucket_lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            raise ModelBusyError(self.name, self.waiting + 1)
+
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+            try:
+                if self.rate > 0:
+                    await self._take_token()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        if waited > 1.0:
+            logger.info(f"Model '{self.name}' call waited {waited:.1f}s for admission")
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_wait_s": round(self.total_wait / self.admitted, 3) if self.admitted else 0.0,
+            "max_wait_s": round(self.max_wait, 3),
+        }
+
+class ModelGovernor:
+    """Holds one ModelLimiter per model type (flash, pro, image)."""
+
+    def __init__(self, limiters: dict[str, ModelLimiter]):
+        self.limiters = limiters
+
+    def slot(self, model_type: str):
+        return self.limiters[model_type].slot()
+
+    def stats(self) -> dict:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
+
+def build_governor(settings) -> ModelGovernor:
+    return ModelGovernor({
+        name: ModelLimiter(
+            name,
+            concurrency=getattr(settings, f"{prefix}_CONCURRENCY"),
+            rate=getattr(settings, f"{prefix}_RATE"),
+            burst=getattr(settings, f"{prefix}_BURST"),
+            max_queue=getattr(settings, f"{prefix}_QUEUE"),
+        )
+        for name, prefix in (("flash", "FLASH"), ("pro", "PRO"), ("image", "IMAGE"))
+    })
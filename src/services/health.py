@@ -0,0 +1,113 @@
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+from aiogram import Bot
+from src.services.vertex_ai import vertex_service
+from src.settings_store import get_async_db
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class DependencyState:
+    ok: Optional[bool] = None      # None until the first check finishes
+    checked_at: float = 0.0        # wall clock time of the last check
+    latency_ms: float = 0.0
+    error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "checked_at": round(self.checked_at, 3),
+            "latency_ms": round(self.latency_ms, 1),
+            "error": self.error,
+        }
+
+class HealthMonitor:
+    """
+    Probes dependencies in the background and keeps the last result of each.
+
+    Health endpoints only read the cached states, so a probe is never
+    triggered by (or multiplied with) incoming health requests.
+    """
+
+    def __init__(self, checks: dict[str, Callable[[], Awaitable]], required: tuple = (),
+                 interval: float = 30.0, timeout: float = 5.0):
+        self.checks = checks
+        self.required = required
+        self.interval = interval
+        self.timeout = timeout
+        self.states = {name: DependencyState() for name in checks}
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, name: str, check):
+        state = self.states[name]
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+            state.ok, state.error = True, None
+        except Exception as e:
+            if state.ok is not False:
+                logger.warning(f"Dependency {name} became unhealthy: {e!r}")
+            state.ok, state.error = False, repr(e)
+        state.latency_ms = (time.perf_counter() - started) * 1000
+        state.checked_at = time.time()
+
+    async def refresh(self):
+        await asyncio.gather(*(self._probe(name, check) for name, check in self.checks.items()))
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Health refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.states[name].ok for name in self.required)
+
+    def snapshot(self) -> dict:
+        return {name: state.as_dict() for name, state in self.states.items()}
+
+def build_checks(bot: Bot) -> dict[str, Callable[[], Awaitable]]:
+    """One cheap request per dependency; backends that aren't configured are skipped."""
+    checks = {}
+
+    if bot:
+        checks["telegram"] = bot.get_me
+
+    async def check_vertex():
+        model = await asyncio.to_thread(lambda: vertex_service.flash_model)
+        await model.count_tokens_async("ping")
+    checks["vertex"] = check_vertex
+
+    async def check_gcs():
+        if not await asyncio.to_thread(lambda: vertex_service.gcs_enabled):
+            raise RuntimeError("GCS not configured")
+        await asyncio.to_thread(vertex_service.gcs_blob("_healthcheck").exists)
+    checks["gcs"] = check_gcs
+
+    async def check_firestore():
+        db = await asyncio.to_thread(get_async_db)
+        if db is None:
+            raise RuntimeError("Firestore client unavailable")
+        await db.collection("user_settings").document("_healthcheck").get()
+    checks["firestore"] = check_firestore
+
+    return checks
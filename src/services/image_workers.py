@@ -0,0 +1,43 @@
+"""
+Functions run in the image worker processes. Kept apart from `imaging` so a
+worker imports only PIL, not aiogram or the app settings.
+"""
+import io
+from PIL import Image, ImageOps
+
+MIME_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+
+def ready() -> bool:
+    # No-op submitted to start a worker ahead of the first image
+    return True
+
+def encode_preview(data: bytes, fmt: str, quality: int, max_side: int) -> bytes:
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format=fmt, quality=quality, optimize=True)
+        return out.getvalue()
+
+def normalize_input(data: bytes, max_side: int) -> tuple[bytes, str]:
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = img.format
+        has_metadata = bool(img.info.get("exif") or img.info.get("icc_profile") or img.getexif())
+        if fmt in ("PNG", "JPEG") and max(img.size) <= max_side and not has_metadata:
+            return data, MIME_TYPES[fmt]
+
+        # Apply EXIF rotation before the metadata is dropped
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA", "P") or fmt == "PNG":
+            img.save(out, format="PNG", optimize=True)
+            return out.getvalue(), MIME_TYPES["PNG"]
+        img.convert("RGB").save(out, format="JPEG", quality=92)
+        return out.getvalue(), MIME_TYPES["JPEG"]
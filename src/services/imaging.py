@@ -0,0 +1,88 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from aiogram.types import BufferedInputFile
+from src.config import settings
+from src.services import image_workers
+from src.services.image_workers import MIME_TYPES
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    "PNG": "png",
+    "JPEG": "jpg",
+    "WEBP": "webp",
+    "GIF": "gif",
+}
+
+def sniff_format(data: bytes) -> Optional[str]:
+    """Detects the image format from magic bytes (PIL format name)."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "WEBP"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    return None
+
+_pool = None
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # forkserver: forking the event loop process (gRPC threads) is unsafe
+        context = multiprocessing.get_context("forkserver")
+        # Workers fork from a server that has already imported PIL
+        context.set_forkserver_preload(["src.services.image_workers"])
+        _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS, mp_context=context)
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def start_pool():
+    """Starts every worker now; otherwise the first images wait for them to boot."""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    await asyncio.gather(*(loop.run_in_executor(pool, image_workers.ready) for _ in range(settings.IMAGE_WORKERS)))
+    logger.info(f"Image workers started in {time.perf_counter() - started:.2f}s")
+
+async def make_preview(image_bytes: bytes, name: str = "image") -> BufferedInputFile:
+    """
+    Size-bounded lossy preview for answer_photo. The lossless original is kept
+    for GCS and 'Скачать файл'; Telegram recompresses photos anyway.
+    """
+    fmt = settings.PREVIEW_FORMAT.upper()
+    try:
+        loop = asyncio.get_running_loop()
+        preview = await loop.run_in_executor(
+            get_pool(), image_workers.encode_preview, image_bytes, fmt, settings.PREVIEW_QUALITY, settings.PREVIEW_MAX_SIDE
+        )
+        if len(preview) < len(image_bytes):
+            return BufferedInputFile(preview, filename=f"{name}.{EXTENSIONS.get(fmt, 'jpg')}")
+    except Exception as e:
+        logger.error(f"Preview encoding failed, sending original: {e}")
+
+    ext = EXTENSIONS.get(sniff_format(image_bytes), "png")
+    return BufferedInputFile(image_bytes, filename=f"{name}.{ext}")
+
+async def prepare_input(image_bytes: bytes) -> tuple[bytes, str]:
+    """
+    Prepares a source image for edit_image: real format, no metadata,
+    downscaled to the largest side the model makes use of. Returns (bytes, mime_type).
+    """
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_pool(), image_workers.normalize_input, image_bytes, settings.EDIT_INPUT_MAX_SIDE)
+    except Exception as e:
+        logger.error(f"Input normalization failed, sending as is: {e}")
+        return image_bytes, MIME_TYPES.get(sniff_format(image_bytes), "image/png")
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, Hashable, Optional
+from aiogram.fsm.context import FSMContext
+from src.config import settings
+from src.services.vertex_ai import vertex_service
+from src.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+class PersistenceQueue:
+    """
+    Background GCS uploads that overlap with the Telegram send.
+
+    Handlers start the upload before sending the photo and `register` it as soon
+    as the photo's file_unique_id is known, before writing that ID to FSM state;
+    from then on `wait` lets a download await the upload. `track` writes the
+    object name to FSM state when the upload finishes.
+    """
+
+    def __init__(self, wait_timeout: float = 60.0, completed_size: int = 10000):
+        self.wait_timeout = wait_timeout
+        self._pending: dict[str, asyncio.Task] = {}
+        self._completed = TTLCache(maxsize=completed_size, ttl=None)
+        self._tasks: set[asyncio.Task] = set()
+        # Read-modify-write of one user's FSM data must not interleave between uploads:
+        # storage key -> [lock, holders and waiters]
+        self._locks: dict[Hashable, list] = {}
+
+    @asynccontextmanager
+    async def _state_lock(self, key: Hashable):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        # Keep a reference so the task isn't garbage collected mid-upload
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _upload(self, image_bytes: bytes) -> Optional[str]:
+        if not vertex_service.gcs_enabled:
+            return None
+        # upload_to_gcs already retries under the storage policy
+        return await vertex_service.upload_to_gcs(image_bytes)
+
+    def start(self, image_bytes: bytes) -> asyncio.Task:
+        """Starts uploading right away; returns the task resolving to the object name."""
+        return self._spawn(self._upload(image_bytes))
+
+    def register(self, upload: asyncio.Task, image_uid: str):
+        """Makes `wait(image_uid)` find the upload; call before the ID goes into FSM state."""
+        self._pending[image_uid] = upload
+        upload.add_done_callback(lambda _: self._settle(upload, image_uid))
+
+    def _settle(self, upload: asyncio.Task, image_uid: str):
+        if self._pending.get(image_uid) is upload:
+            del self._pending[image_uid]
+        if not upload.cancelled() and upload.exception() is None and upload.result():
+            self._completed.set(image_uid, upload.result())
+
+    def track(self, upload: asyncio.Task, image_uid: str, state: FSMContext,
+              on_done: Optional[Callable[[Optional[str]], None]] = None):
+        """Records the object name for `image_uid` in FSM state once `upload` finishes."""
+        self._spawn(self._finish(upload, image_uid, state, on_done))
+
+    async def _finish(self, upload: asyncio.Task, image_uid: str, state: FSMContext, on_done):
+        file_name = await upload
+        if not file_name:
+            return
+
+        if on_done:
+            on_done(file_name)
+        try:
+            async with self._state_lock(state.key):
+                await record_in_state(state, image_uid, file_name)
+        except Exception as e:
+            logger.error(f"Could not record GCS object {file_name} in state: {e}")
+
+    async def wait(self, image_uid: Optional[str]) -> Optional[str]:
+        """Object name for an image, awaiting its upload if it is still running."""
+        if not image_uid:
+            return None
+        upload = self._pending.get(image_uid)
+        if upload is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(upload), timeout=self.wait_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Pending GCS upload for {image_uid} not finished in {self.wait_timeout}s")
+                return None
+        return self._completed.get(image_uid)
+
+async def record_in_state(state: FSMContext, image_uid: str, file_name: str):
+    data = await state.get_data()
+    changes = {}
+    if data.get("last_image_uid") == image_uid:
+        changes["gcs_file_name"] = file_name
+    variants = data.get("variants")
+    if variants and any(v.get("file_uid") == image_uid for v in variants):
+        changes["variants"] = [
+            {**v, "gcs_file_name": file_name} if v.get("file_uid") == image_uid else v
+            for v in variants
+        ]
+    if changes:
+        await state.update_data(**changes)
+
+persistence = PersistenceQueue(wait_timeout=settings.UPLOAD_WAIT_TIMEOUT)
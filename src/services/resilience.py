@@ -0,0 +1,216 @@
+import time
+import random
+import asyncio
+import logging
+from google.api_core import exceptions as gexc
+from src.utils.metrics import registry
+from src.services.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+BACKEND_CALLS = registry.histogram(
+    "backend_call_duration_seconds", "Duration of single backend call attempts", ("backend", "outcome")
+)
+BACKEND_RETRIES = registry.counter("backend_retries_total", "Retried backend calls", ("backend",))
+BACKEND_THROTTLED = registry.counter(
+    "backend_throttled_total", "429 / RESOURCE_EXHAUSTED responses from backends", ("backend",)
+)
+
+# Rate limits / quota exhaustion
+THROTTLED_ERRORS = (gexc.TooManyRequests, gexc.ResourceExhausted)
+
+# Transient backend failures that are safe to retry
+TRANSIENT_ERRORS = THROTTLED_ERRORS + (
+    gexc.ServiceUnavailable,
+    gexc.InternalServerError,
+    gexc.BadGateway,
+    gexc.GatewayTimeout,
+    gexc.DeadlineExceeded,
+    gexc.Aborted,
+    ConnectionError,
+)
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while its circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_in:.0f}s")
+
+def is_transient(exc: BaseException) -> bool:
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+def is_throttled(exc: BaseException) -> bool:
+    return isinstance(exc, THROTTLED_ERRORS)
+
+def outcome(exc: BaseException = None) -> str:
+    """Short label for how a call ended, for metrics."""
+    if exc is None:
+        return "ok"
+    if isinstance(exc, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    if is_throttled(exc):
+        return "throttled"
+    if is_transient(exc):
+        return "transient"
+    return "error"
+
+def retry_after(exc: BaseException):
+    """Returns the server's retry hint in seconds (Retry-After header or google.rpc.RetryInfo), if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers:
+        value = headers.get("Retry-After")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+
+    for detail in getattr(exc, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive transient failures and rejects
+    calls for `reset_timeout` seconds; then lets a single probe call through.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            raise CircuitOpenError(self.name, retry_in)
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Circuit '{self.name}' closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release(self):
+        """Ends a call that says nothing about backend health (e.g. a rejected request)."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.error(f"Circuit '{self.name}' opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+class RetryPolicy:
+    """
+    Retries transient google-api-core errors with decorrelated jitter backoff,
+    honoring server retry hints, within an overall deadline budget.
+
+    Each attempt is cut off when the budget runs out (whatever timeout the call
+    itself uses), and no retry starts with less than `min_attempt` seconds left.
+    """
+
+    def __init__(self, name: str, max_attempts: int = 4, base_delay: float = 1.0,
+                 max_delay: float = 20.0, deadline: float = 60.0, min_attempt: float = 2.0,
+                 breaker: CircuitBreaker = None):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.min_attempt = min_attempt
+        self.breaker = breaker
+
+    def next_delay(self, previous: float) -> float:
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    async def call(self, func, *args, **kwargs):
+        started = time.monotonic()
+        delay = self.base_delay
+
+        for attempt in range(1, self.max_attempts + 1):
+            if self.breaker:
+                self.breaker.before_call()
+            attempt_started = time.perf_counter()
+            remaining = self.deadline - (time.monotonic() - started)
+            try:
+                with tracer.span(f"{self.name}.attempt", attempt=attempt):
+                    # Clips the call's own timeout to what is left of the budget
+                    async with asyncio.timeout(remaining):
+                        result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                if self.breaker:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                BACKEND_CALLS.observe(time.perf_counter() - attempt_started, self.name, outcome(e))
+                if is_throttled(e):
+                    BACKEND_THROTTLED.inc(self.name)
+                transient = is_transient(e)
+                if self.breaker:
+                    if transient or isinstance(e, asyncio.TimeoutError):
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.release()
+                if not transient:
+                    raise
+
+                delay = self.next_delay(delay)
+                hint = retry_after(e)
+                if hint is not None:
+                    delay = max(delay, hint)
+
+                remaining = self.deadline - (time.monotonic() - started)
+                if attempt == self.max_attempts or delay + self.min_attempt > remaining:
+                    logger.error(f"[{self.name}] giving up after {attempt} attempts: {e}")
+                    raise
+
+                logger.warning(f"[{self.name}] {type(e).__name__}, retrying in {delay:.1f}s (attempt {attempt}/{self.max_attempts})")
+                BACKEND_RETRIES.inc(self.name)
+                await asyncio.sleep(delay)
+            else:
+                BACKEND_CALLS.observe(time.perf_counter() - attempt_started, self.name, "ok")
+                if self.breaker:
+                    self.breaker.record_success()
+                return result
+
+def build_policy(name: str, settings, deadline: float) -> RetryPolicy:
+    return RetryPolicy(
+        name,
+        max_attempts=settings.RETRY_MAX_ATTEMPTS,
+        base_delay=settings.RETRY_BASE_DELAY,
+        max_delay=settings.RETRY_MAX_DELAY,
+        deadline=deadline,
+        min_attempt=settings.RETRY_MIN_ATTEMPT,
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+        ),
+    )
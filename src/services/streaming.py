@@ -0,0 +1,77 @@
+import time
+import logging
+from aiogram.types import Message
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+def split_text(text: str, limit: int = TELEGRAM_TEXT_LIMIT) -> list[str]:
+    """Splits text into Telegram-sized chunks, preferring paragraph and line breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """
+    Progressively edits a placeholder message while a reply is being streamed.
+    Edits are coalesced to one per `min_interval` seconds to stay within
+    Telegram's per-chat limits; text past 4096 characters continues in a new message.
+    """
+
+    def __init__(self, placeholder: Message, min_interval: float = 1.0, limit: int = TELEGRAM_TEXT_LIMIT):
+        self.message = placeholder
+        self.min_interval = min_interval
+        self.limit = limit
+        self.text = ""          # full reply so far
+        self._offset = 0        # start of the part shown in the current message
+        self._shown = ""        # what the current message currently displays
+        self._last_edit = 0.0
+
+    async def feed(self, chunk: str):
+        self.text += chunk
+        if time.monotonic() - self._last_edit >= self.min_interval:
+            await self._render()
+
+    async def finish(self, reply_markup=None):
+        await self._render(reply_markup=reply_markup, final=True)
+
+    async def _render(self, reply_markup=None, final: bool = False):
+        # Roll over to a new message once the current one is full
+        while len(self.text) - self._offset > self.limit:
+            current = split_text(self.text[self._offset:], self.limit)[0]
+            await self._edit(current)
+            self._offset += len(current)
+            while self._offset < len(self.text) and self.text[self._offset] == "\n":
+                self._offset += 1
+            self.message = await self.message.answer("⏳ ...")
+            self._shown = ""
+
+        tail = self.text[self._offset:]
+        if not tail:
+            return
+        if final:
+            await self._edit(tail, reply_markup=reply_markup, force=reply_markup is not None)
+        else:
+            # Typing cursor, unless it would push the message over the limit
+            await self._edit(tail + " ▌" if len(tail) + 2 <= self.limit else tail)
+
+    async def _edit(self, text: str, reply_markup=None, force: bool = False):
+        if text == self._shown and not force:
+            return
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup)
+            self._shown = text
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                raise
+        self._last_edit = time.monotonic()
@@ -0,0 +1,135 @@
+import json
+import time
+import uuid
+import random
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("trace")
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "started", "finished", "dropped")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: list["Span"] = []
+        self.started = time.perf_counter()
+        self.finished = False
+        self.dropped = 0
+
+class Span:
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start", "duration", "attrs", "error")
+
+    def __init__(self, name: str, trace: Trace, parent_id: Optional[str], attrs: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ms": round((self.start - self.trace.started) * 1000, 1),
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+class Tracer:
+    """
+    Minimal in-process tracing: one root span per update, child spans found
+    through contextvars (so they follow awaits and tasks created inside).
+
+    Every trace is collected; on completion it is logged as one JSON line if it
+    was sampled, failed, or took longer than `slow_threshold` seconds.
+    """
+
+    def __init__(self, sample_rate: float = 0.01, slow_threshold: float = 5.0, max_spans: int = 200):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_spans = max_spans
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Starts a new trace with a root span."""
+        trace = Trace()
+        root = None
+        try:
+            with self._span(name, trace, None, attrs, activate=True) as root:
+                yield root
+        finally:
+            trace.finished = True
+            if root is not None:
+                self._export(trace, root)
+
+    @contextmanager
+    def span(self, name: str, activate: bool = True, **attrs):
+        """
+        Child span of the current one; a no-op outside a trace.
+        `activate=False` records the span without making it current (for async
+        generators, whose body shares the consumer's context between yields).
+        """
+        parent = _current.get()
+        if parent is None or parent.trace.finished:
+            yield None
+            return
+        trace = parent.trace
+        if len(trace.spans) >= self.max_spans:
+            trace.dropped += 1
+            yield None
+            return
+        with self._span(name, trace, parent.span_id, attrs, activate) as span:
+            yield span
+
+    @contextmanager
+    def _span(self, name: str, trace: Trace, parent_id: Optional[str], attrs: dict, activate: bool):
+        span = Span(name, trace, parent_id, attrs)
+        trace.spans.append(span)
+        token = _current.set(span) if activate else None
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            if token is not None:
+                _current.reset(token)
+
+    def _export(self, trace: Trace, root: Span):
+        slow = root.duration >= self.slow_threshold
+        failed = any(span.error for span in trace.spans)
+        if not (slow or failed or random.random() < self.sample_rate):
+            return
+        try:
+            trace_logger.info(json.dumps({
+                "trace_id": trace.trace_id,
+                "name": root.name,
+                "duration_ms": round(root.duration * 1000, 1),
+                "slow": slow,
+                "error": failed,
+                "dropped_spans": trace.dropped,
+                "spans": [span.as_dict() for span in trace.spans],
+            }, ensure_ascii=False, default=str))
+        except Exception as e:
+            logger.error(f"Trace export failed: {e}")
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+tracer = Tracer(sample_rate=settings.TRACE_SAMPLE_RATE, slow_threshold=settings.TRACE_SLOW_THRESHOLD)
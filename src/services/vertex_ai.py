@@ -1,6 +1,17 @@
 import vertexai
 from vertexai.generative_models import GenerativeModel, Part, Image
 from src.config import settings
+from src.services.governor import build_governor, ModelBusyError
+from src.services.resilience import build_policy, outcome
+from src.services.imaging import sniff_format, MIME_TYPES, EXTENSIONS
+from src.utils.lazy import LazySingleton
+from src.utils.singleflight import SingleFlight
+from src.utils.metrics import registry
+from src.services.tracing import tracer
+from contextlib import contextmanager
+from functools import partial
+import time
+import hashlib
 import base64
 import asyncio
 import logging
@@ -10,24 +21,128 @@ logger = logging.getLogger(__name__)
 from google.cloud import storage
 import uuid
 
+VERTEX_REQUESTS = registry.histogram(
+    "vertex_request_duration_seconds", "VertexAIService calls including queueing and retries",
+    ("method", "model", "outcome")
+)
+VERTEX_COALESCED = registry.counter(
+    "vertex_coalesced_total", "Duplicate calls that reused an identical call already in flight", ("method",)
+)
+GCS_TRANSFER_SECONDS = registry.histogram("gcs_transfer_duration_seconds", "GCS transfers", ("direction",))
+GCS_TRANSFER_BYTES = registry.counter("gcs_transfer_bytes_total", "Bytes moved to/from GCS", ("direction",))
+
+@contextmanager
+def _observe(method: str, model: str, activate: bool = True):
+    started = time.perf_counter()
+    result = "ok"
+    try:
+        with tracer.span(f"vertex.{method}", activate=activate, model=model):
+            yield
+    except BaseException as e:
+        result = "busy" if isinstance(e, ModelBusyError) else outcome(e)
+        raise
+    finally:
+        VERTEX_REQUESTS.observe(time.perf_counter() - started, method, model, result)
+
+def _fingerprint(*parts) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        elif isinstance(part, list):
+            # Chat history: a list of `Content`
+            for item in part:
+                digest.update(repr(item.to_dict()).encode())
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
 class VertexAIService:
     def __init__(self):
+        # SDK init, models and the GCS client are built on first use (or by
+        # warm_up), so importing this module stays cheap
+        self._vertex = LazySingleton(self._init_vertex)
+        self._models = {
+            "flash": LazySingleton(partial(self._build_model, "gemini-3-flash-preview")),
+            "pro": LazySingleton(partial(self._build_model, "gemini-3-pro-preview")),
+            "image": LazySingleton(partial(self._build_model, "gemini-3-pro-image-preview")),
+        }
+        self._storage = LazySingleton(self._build_storage_client)
+
+        # Per-model concurrency/rate limits with a bounded wait queue
+        self.governor = build_governor(settings)
+
+        # Retry policy + circuit breaker per backend
+        self.retry = {
+            "flash": build_policy("flash", settings, deadline=settings.TEXT_RETRY_DEADLINE),
+            "pro": build_policy("pro", settings, deadline=settings.TEXT_RETRY_DEADLINE),
+            "image": build_policy("image", settings, deadline=settings.IMAGE_RETRY_DEADLINE),
+            "gcs": build_policy("gcs", settings, deadline=settings.STORAGE_RETRY_DEADLINE),
+        }
+
+        # Identical requests of one user share a single model call
+        self.in_flight = SingleFlight()
+
+    @staticmethod
+    def _init_vertex():
         vertexai.init(
             project=settings.PROJECT_ID, 
             location=settings.REGION 
         )
-        
-        self.flash_model = GenerativeModel("gemini-3-flash-preview") 
-        self.pro_model = GenerativeModel("gemini-3-pro-preview")
-        self.image_model = GenerativeModel("gemini-3-pro-image-preview")
-        
-        # Initialize GCS client
+
+    def _build_model(self, model_name: str) -> GenerativeModel:
+        self._vertex()
+        return GenerativeModel(model_name)
+
+    @staticmethod
+    def _build_storage_client():
         try:
-            self.storage_client = storage.Client(project=settings.PROJECT_ID)
+            client = storage.Client(project=settings.PROJECT_ID)
             logger.info(f"GCS client initialized successfully for project {settings.PROJECT_ID}")
+            return client
         except Exception as e:
             logger.error(f"Failed to initialize GCS client: {e}")
-            self.storage_client = None
+            return None
+
+    @property
+    def flash_model(self) -> GenerativeModel:
+        return self._models["flash"]()
+
+    @property
+    def pro_model(self) -> GenerativeModel:
+        return self._models["pro"]()
+
+    @property
+    def image_model(self) -> GenerativeModel:
+        return self._models["image"]()
+
+    @property
+    def storage_client(self):
+        return self._storage()
+
+    async def warm_up(self):
+        """Builds the models and the GCS client in parallel and opens the GCS connection."""
+        async def _warm_gcs():
+            await asyncio.to_thread(self._storage)
+            if self.gcs_enabled:
+                try:
+                    await asyncio.to_thread(self.gcs_blob("_warmup").exists)
+                except Exception as e:
+                    logger.warning(f"GCS warm-up request failed: {e}")
+
+        results = await asyncio.gather(
+            *(asyncio.to_thread(model) for model in self._models.values()),
+            _warm_gcs(),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Vertex AI warm-up step failed: {result}")
+
+    @property
+    def gcs_enabled(self) -> bool:
+        return bool(settings.GCS_BUCKET_NAME and self.storage_client)
 
     async def upload_to_gcs(self, image_bytes: bytes) -> str:
         """Uploads image to GCS and returns the file name (UUID)"""
@@ -40,13 +155,17 @@ class VertexAIService:
             
         try:
             bucket = self.storage_client.bucket(settings.GCS_BUCKET_NAME)
-            file_name = f"{uuid.uuid4()}.png"
+            # Store the original as-is, with its real content type
+            fmt = sniff_format(image_bytes) or "PNG"
+            file_name = f"{uuid.uuid4()}.{EXTENSIONS[fmt]}"
             blob = bucket.blob(file_name)
             
             logger.info(f"Uploading {len(image_bytes)} bytes to GCS bucket {settings.GCS_BUCKET_NAME} as {file_name}")
             
             # Use run_in_executor for synchronous GCS library
-            await asyncio.to_thread(blob.upload_from_string, image_bytes, content_type="image/png")
+            with GCS_TRANSFER_SECONDS.time("upload"), tracer.span("gcs.upload", bytes=len(image_bytes)):
+                await self.retry["gcs"].call(asyncio.to_thread, blob.upload_from_string, image_bytes, content_type=MIME_TYPES[fmt])
+            GCS_TRANSFER_BYTES.inc("upload", amount=len(image_bytes))
             
             logger.info("GCS Upload successful")
             return file_name
@@ -54,6 +173,12 @@ class VertexAIService:
             logger.error(f"GCS Upload failed: {e}", exc_info=True)
             return None
 
+    def gcs_blob(self, file_name: str):
+        """Blob handle for streaming reads; no network call is made here"""
+        if not self.gcs_enabled:
+            return None
+        return self.storage_client.bucket(settings.GCS_BUCKET_NAME).blob(file_name)
+
     async def download_from_gcs(self, file_name: str) -> bytes:
         """Downloads image from GCS"""
         if not self.storage_client or not settings.GCS_BUCKET_NAME:
@@ -64,49 +189,81 @@ class VertexAIService:
             logger.info(f"Downloading {file_name} from GCS bucket {settings.GCS_BUCKET_NAME}")
             bucket = self.storage_client.bucket(settings.GCS_BUCKET_NAME)
             blob = bucket.blob(file_name)
-            data = await asyncio.to_thread(blob.download_as_bytes)
+            with GCS_TRANSFER_SECONDS.time("download"), tracer.span("gcs.download", file=file_name):
+                data = await self.retry["gcs"].call(asyncio.to_thread, blob.download_as_bytes)
+            GCS_TRANSFER_BYTES.inc("download", amount=len(data))
             logger.info(f"Downloaded {len(data)} bytes from GCS")
             return data
         except Exception as e:
             logger.error(f"GCS Download failed for {file_name}: {e}", exc_info=True)
             return None
 
-    async def _retry_request(self, func, *args, **kwargs):
-        """Retry wrapper for 429 errors"""
-        max_retries = 3
-        base_delay = 2
-        
-        for attempt in range(max_retries):
-            try:
-                return await func(*args, **kwargs)
-            except Exception as e:
-                error_str = str(e)
-                logger.error(f"Attempt {attempt+1} failed: {error_str}")
-                # Check for Quota/Resource Exhausted errors
-                if "429" in error_str or "Resource exhausted" in error_str or "exhausted" in error_str:
-                    if attempt == max_retries - 1:
-                        logger.error("Max retries reached for rate limit.")
-                        raise e
-                    
-                    delay = base_delay * (2 ** attempt) # Exponential backoff: 2, 4, 8
-                    logger.warning(f"Got 429/Quota, retrying in {delay}s... (Attempt {attempt+1}/{max_retries})")
-                    await asyncio.sleep(delay)
-                else:
-                    # Non-retryable error
-                    raise e
-
-    async def generate_text(self, prompt: str, history: list = None, model_type: str = "flash") -> str:
+    async def _coalesce(self, user_id: int, method: str, func, *request):
+        """
+        Runs `func`, or awaits the same user's identical `request` already in flight.
+        Messages of a chat are handled one at a time and redelivered updates are
+        dropped at ingress, so what overlaps here is button presses (a double tap
+        on "🔄"). Streamed chat replies don't go through this. No user: always runs.
+        """
+        if user_id is None:
+            return await func()
+        result, shared = await self.in_flight.do((user_id, method, _fingerprint(*request)), func)
+        if shared:
+            VERTEX_COALESCED.inc(method)
+            logger.info(f"{method} for user {user_id} served by an identical call in flight")
+        return result
+
+    async def generate_text(self, prompt: str, history: list = None, model_type: str = "flash",
+                            user_id: int = None) -> str:
         model = self.flash_model if model_type == "flash" else self.pro_model
+        limit_key = "flash" if model_type == "flash" else "pro"
         
         async def _call():
             chat = model.start_chat(history=history or [])
             # Increased timeout for text generation as well
-            response = await asyncio.wait_for(chat.send_message_async(prompt), timeout=120.0)
+            async with self.governor.slot(limit_key):
+                response = await asyncio.wait_for(chat.send_message_async(prompt), timeout=120.0)
             return response.text
 
-        return await self._retry_request(_call)
+        async def _generate():
+            with _observe("generate_text", limit_key):
+                return await self.retry[limit_key].call(_call)
+
+        return await self._coalesce(user_id, "generate_text", _generate, model_type, prompt, history or [])
 
-    async def generate_image(self, prompt: str, aspect_ratio: str = "1:1") -> tuple[bytes, str]:
+    async def generate_text_stream(self, prompt: str, history: list = None, model_type: str = "flash"):
+        """Yields text chunks as the model produces them"""
+        model = self.flash_model if model_type == "flash" else self.pro_model
+        limit_key = "flash" if model_type == "flash" else "pro"
+
+        async def _call():
+            chat = model.start_chat(history=history or [])
+            return await asyncio.wait_for(chat.send_message_async(prompt, stream=True), timeout=120.0)
+
+        # The slot is held for the whole stream, not just until the first chunk
+        # Not made the current span: the consumer runs between chunks
+        with _observe("generate_text_stream", limit_key, activate=False):
+            async with self.governor.slot(limit_key):
+                # Only opening the stream is retried; chunks already shown to the user can't be replayed
+                responses = await self.retry[limit_key].call(_call)
+                iterator = responses.__aiter__()
+                while True:
+                    try:
+                        # Idle timeout between chunks instead of one deadline for the whole reply
+                        chunk = await asyncio.wait_for(iterator.__anext__(), timeout=120.0)
+                    except StopAsyncIteration:
+                        break
+                    try:
+                        text = chunk.text
+                    except (ValueError, AttributeError):
+                        # Chunks without text parts (e.g. the final one carrying only finish_reason)
+                        continue
+                    if text:
+                        yield text
+
+    async def generate_image(self, prompt: str, aspect_ratio: str = "1:1", user_id: int = None,
+                             variant: int = 0) -> tuple[bytes, str]:
+        """`variant` tells apart calls made on purpose with the same prompt (several variants at once)."""
         # Strict instructions to avoid JSON and tool-calling behavior
         full_prompt = (
             f"User request: '{prompt}'. "
@@ -122,7 +279,8 @@ class VertexAIService:
         
         async def _call():
             # Increased timeout significantly for image generation
-            response = await asyncio.wait_for(self.image_model.generate_content_async(full_prompt), timeout=300.0)
+            async with self.governor.slot("image"):
+                response = await asyncio.wait_for(self.image_model.generate_content_async(full_prompt), timeout=300.0)
             
             image_bytes = None
             text_response = ""
@@ -171,21 +329,31 @@ class VertexAIService:
                 
             return image_bytes, clean_text
 
-        return await self._retry_request(_call)
+        async def _generate():
+            with _observe("generate_image", "image"):
+                return await self.retry["image"].call(_call)
 
-    async def edit_image(self, image_bytes: bytes, prompt: str) -> bytes:
-        image_part = Part.from_data(data=image_bytes, mime_type="image/png")
+        return await self._coalesce(user_id, "generate_image", _generate, prompt, aspect_ratio, variant)
+
+    async def edit_image(self, image_bytes: bytes, prompt: str, mime_type: str = None, user_id: int = None) -> bytes:
+        mime_type = mime_type or MIME_TYPES.get(sniff_format(image_bytes), "image/png")
+        image_part = Part.from_data(data=image_bytes, mime_type=mime_type)
         
         async def _call():
-            response = await asyncio.wait_for(
-                self.image_model.generate_content_async([prompt, image_part]),
-                timeout=90.0
-            )
+            async with self.governor.slot("image"):
+                response = await asyncio.wait_for(
+                    self.image_model.generate_content_async([prompt, image_part]),
+                    timeout=90.0
+                )
             for part in response.candidates[0].content.parts:
                 if hasattr(part, 'inline_data') and part.inline_data:
                     return part.inline_data.data
             raise ValueError("No edited image generated")
 
-        return await self._retry_request(_call)
+        async def _edit():
+            with _observe("edit_image", "image"):
+                return await self.retry["image"].call(_call)
+
+        return await self._coalesce(user_id, "edit_image", _edit, image_bytes, prompt, mime_type)
 
 vertex_service = VertexAIService()
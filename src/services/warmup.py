@@ -0,0 +1,26 @@
+import time
+import asyncio
+import logging
+from src.services.vertex_ai import vertex_service
+from src.services.imaging import start_pool
+from src import settings_store
+
+logger = logging.getLogger(__name__)
+
+async def warm_up():
+    """
+    Builds all backend clients and starts the image workers in parallel,
+    so the first update doesn't pay for it.
+    """
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        vertex_service.warm_up(), settings_store.warm_up(), start_pool(), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up step failed: {result}")
+    logger.info(f"Backend clients warmed up in {time.perf_counter() - started:.2f}s")
+
+def start_warm_up() -> asyncio.Task:
+    """Runs warm_up in the background; startup doesn't wait for it."""
+    return asyncio.create_task(warm_up())
@@ -0,0 +1,70 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from aiogram import Bot
+from src.config import settings
+from src.services.vertex_ai import vertex_service
+from src.services.persistence import persistence
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class WorkingImage:
+    key: str                       # Telegram file_unique_id (file_id when unknown)
+    data: bytes
+
+class WorkingImageCache:
+    """
+    Latest original image bytes per user, bounded by a total memory budget.
+    Edit chains read the lossless original from here instead of downloading
+    Telegram's recompressed copy again.
+    """
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._images: "OrderedDict[int, WorkingImage]" = OrderedDict()
+
+    def put(self, user_id: int, data: bytes, key: str):
+        if len(data) > self.max_bytes:
+            return
+        old = self._images.pop(user_id, None)
+        if old:
+            self.size -= len(old.data)
+        self._images[user_id] = WorkingImage(key, data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._images.popitem(last=False)
+            self.size -= len(evicted.data)
+
+    def get(self, user_id: int, key: str) -> Optional[bytes]:
+        image = self._images.get(user_id)
+        if image is None or image.key != key:
+            return None
+        self._images.move_to_end(user_id)
+        return image.data
+
+    async def fetch(self, user_id: int, bot: Bot, file_id: str, key: Optional[str] = None,
+                    gcs_file_name: Optional[str] = None) -> bytes:
+        """Memory first, then the GCS original (awaiting its upload if still running), then Telegram's copy."""
+        # file_id of one photo can differ between messages, file_unique_id can't
+        key = key or file_id
+        data = self.get(user_id, key)
+        if data is not None:
+            return data
+
+        # The object name reaches FSM state only once the background upload is done
+        gcs_file_name = gcs_file_name or await persistence.wait(key)
+        if gcs_file_name:
+            data = await vertex_service.download_from_gcs(gcs_file_name)
+
+        if data is None:
+            file = await bot.get_file(file_id)
+            image_io = await bot.download_file(file.file_path)
+            data = image_io.read()
+
+        self.put(user_id, data, key)
+        return data
+
+working_images = WorkingImageCache(max_bytes=settings.WORKING_IMAGE_CACHE_BYTES)
@@ -1,16 +1,34 @@
+import asyncio
 import logging
+from datetime import datetime, timezone
 from google.cloud import firestore
 from src.config import settings
+from src.utils.cache import TTLCache
+from src.services.resilience import build_policy
+from src.utils.lazy import LazySingleton
 
 logger = logging.getLogger(__name__)
 
-# Initialize Firestore
-try:
-    db = firestore.Client(project=settings.PROJECT_ID)
-    users_ref = db.collection("user_settings")
-except Exception as e:
-    logger.error(f"Failed to initialize Firestore: {e}")
-    db = None
+def _build_db():
+    try:
+        return firestore.Client(project=settings.PROJECT_ID)
+    except Exception as e:
+        logger.error(f"Failed to initialize Firestore: {e}")
+        return None
+
+def _build_async_db():
+    try:
+        return firestore.AsyncClient(project=settings.PROJECT_ID)
+    except Exception as e:
+        logger.error(f"Failed to initialize async Firestore: {e}")
+        return None
+
+# Clients are built on first use (or by warm_up), not at import
+get_db = LazySingleton(_build_db)
+get_async_db = LazySingleton(_build_async_db)
+
+# Shared retry policy / circuit breaker for Firestore calls
+firestore_retry = build_policy("firestore", settings, deadline=settings.FIRESTORE_RETRY_DEADLINE)
 
 DEFAULT_SETTINGS = {
     "aspect_ratio": "1:1",
@@ -19,29 +37,208 @@ DEFAULT_SETTINGS = {
     "resolution": "Standard" # Standard, HD, 4K
 }
 
-def get_user_settings(user_id: int) -> dict:
-    if db is None:
-        return DEFAULT_SETTINGS.copy()
-        
-    try:
-        doc = users_ref.document(str(user_id)).get()
+class SettingsRepository:
+    """
+    Async access to the `user_settings` collection with a bounded TTL/LRU cache.
+    Cache hits never touch Firestore. Every write stamps the document with
+    `updated_at`, and `watch` listens for those stamps so an entry is dropped as
+    soon as any instance changes the document; the TTL only bounds staleness
+    while the listener is down.
+
+    `apply` changes the cache at once and coalesces the writes of one user made
+    within `write_delay` seconds into a single Firestore write.
+    """
+
+    def __init__(self, client_factory, collection: str = "user_settings", cache_size: int = 10000,
+                 cache_ttl: float = 300.0, write_delay: float = 1.0, watch_client_factory=None):
+        self.client_factory = client_factory
+        # Listeners need the sync client
+        self.watch_client_factory = watch_client_factory
+        self._watch = None
+        self.collection = collection
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.write_delay = write_delay
+        # user_id -> changes not yet written
+        self._pending: dict[int, dict] = {}
+        # user_id -> task waiting out write_delay; writes under way
+        self._writers: dict[int, asyncio.Task] = {}
+        self._writes: set[asyncio.Task] = set()
+
+    @property
+    def client(self):
+        return self.client_factory()
+
+    def _doc(self, user_id: int):
+        return self.client.collection(self.collection).document(str(user_id))
+
+    async def get(self, user_id: int) -> dict:
+        user_settings = await self._load(user_id)
+        return user_settings if user_settings is not None else DEFAULT_SETTINGS.copy()
+
+    async def _load(self, user_id: int):
+        """Cached or stored settings (cached on a read); None if Firestore can't be read."""
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached.copy()
+
+        if self.client is None:
+            return DEFAULT_SETTINGS.copy()
+
+        try:
+            doc = await firestore_retry.call(self._doc(user_id).get)
+        except Exception as e:
+            logger.error(f"Error fetching settings for {user_id}: {e}")
+            return None
+        user_settings = DEFAULT_SETTINGS.copy()
         if doc.exists:
-            return doc.to_dict()
-    except Exception as e:
-        logger.error(f"Error fetching settings for {user_id}: {e}")
-        
-    return DEFAULT_SETTINGS.copy()
+            user_settings.update(doc.to_dict())
+            user_settings.pop("updated_at", None)
+        # Changes still waiting for their write win over the stored document
+        user_settings.update(self._pending.get(user_id, {}))
+        self.cache.set(user_id, user_settings)
+        return user_settings.copy()
 
-def update_user_setting(user_id: int, key: str, value: any):
-    if db is None:
-        return
-        
-    try:
-        users_ref.document(str(user_id)).set({key: value}, merge=True)
-    except Exception as e:
-        logger.error(f"Error updating setting for {user_id}: {e}")
+    async def apply(self, user_id: int, key: str, value: any) -> dict:
+        """
+        Changes a setting locally right away and schedules a coalesced write of the
+        changed fields. Returns the new settings.
+        """
+        user_settings = await self._load(user_id)
+        if user_settings is None:
+            # The stored settings are unknown: don't let defaults stand in for them
+            user_settings = {**DEFAULT_SETTINGS, **self._pending.get(user_id, {}), key: value}
+        else:
+            user_settings[key] = value
+            self.cache.set(user_id, user_settings.copy())
+
+        if self.client is not None:
+            self._pending.setdefault(user_id, {})[key] = value
+            if user_id not in self._writers:
+                self._writers[user_id] = asyncio.create_task(self._write_later(user_id))
+        return user_settings
+
+    async def _write_later(self, user_id: int):
+        try:
+            await asyncio.sleep(self.write_delay)
+        finally:
+            self._writers.pop(user_id, None)
+        # Separate task: cancelling the delay (flush) must not cancel a write under way
+        self._start_write(user_id)
+
+    def _start_write(self, user_id: int):
+        task = asyncio.create_task(self._write(user_id))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, user_id: int):
+        changes = self._pending.pop(user_id, None)
+        if not changes:
+            return
+        try:
+            await firestore_retry.call(
+                self._doc(user_id).set, {**changes, "updated_at": firestore.SERVER_TIMESTAMP}, merge=True
+            )
+        except Exception as e:
+            logger.error(f"Error writing settings for {user_id}: {e}")
+            # Local copy no longer matches Firestore
+            self.invalidate(user_id)
+
+    async def flush(self):
+        """Writes all pending changes now and waits for writes under way (on shutdown)."""
+        for task in list(self._writers.values()):
+            task.cancel()
+        self._writers.clear()
+        for user_id in list(self._pending):
+            self._start_write(user_id)
+        await asyncio.gather(*list(self._writes), return_exceptions=True)
+
+    def invalidate(self, user_id: int):
+        self.cache.pop(user_id)
+
+    async def watch(self):
+        """Starts dropping cached settings whose document changes (call on startup)."""
+        if self._watch is not None or self.watch_client_factory is None:
+            return
+        client = await asyncio.to_thread(self.watch_client_factory)
+        if client is None:
+            return
+        loop = asyncio.get_running_loop()
+
+        def on_snapshot(docs, changes, read_time):
+            # Runs in the listener's thread
+            for change in changes:
+                loop.call_soon_threadsafe(self._on_changed, change.document.id)
+
+        # Only documents written from now on: nothing older can be in the cache
+        query = client.collection(self.collection).where(
+            filter=firestore.FieldFilter("updated_at", ">", datetime.now(timezone.utc))
+        )
+        try:
+            self._watch = query.on_snapshot(on_snapshot)
+            logger.info("Watching user settings for changes")
+        except Exception as e:
+            logger.error(f"Could not watch user settings, relying on the cache TTL: {e}")
+
+    def _on_changed(self, doc_id: str):
+        try:
+            self.invalidate(int(doc_id))
+        except ValueError:
+            pass
+
+    async def close(self):
+        """Stops the listener and writes pending changes (on shutdown)."""
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+        await self.flush()
+
+settings_repo = SettingsRepository(
+    get_async_db,
+    cache_size=settings.SETTINGS_CACHE_SIZE,
+    cache_ttl=settings.SETTINGS_CACHE_TTL,
+    write_delay=settings.SETTINGS_WRITE_DELAY,
+    watch_client_factory=get_db
+)
+
+async def get_user_settings(user_id: int) -> dict:
+    return await settings_repo.get(user_id)
+
+async def apply_user_setting(user_id: int, key: str, value: any) -> dict:
+    return await settings_repo.apply(user_id, key, value)
 
 def get_all_user_ids():
+    """Loads every user ID at once; prefer iter_user_ids for large collections."""
+    db = get_db()
     if db is None:
         return []
-    return [doc.id for doc in users_ref.stream()]
+    return [doc.id for doc in db.collection("user_settings").stream()]
+
+async def iter_user_ids(page_size: int = 500, start_after: str = None):
+    """
+    Yields pages of user IDs in document ID order using query cursors,
+    so only one page is held in memory. `start_after` resumes after that ID.
+    """
+    db = get_async_db()
+    if db is None:
+        return
+    # Keys only: no fields are transferred
+    query = db.collection("user_settings").order_by("__name__").select([]).limit(page_size)
+    while True:
+        page_query = query.start_after({"__name__": start_after}) if start_after else query
+        docs = await firestore_retry.call(page_query.get)
+        ids = [doc.id for doc in docs]
+        if ids:
+            yield ids
+        if len(ids) < page_size:
+            return
+        start_after = ids[-1]
+
+async def warm_up():
+    """Builds the async client and opens its channel with one cheap read."""
+    db = await asyncio.to_thread(get_async_db)
+    if db is None:
+        return
+    try:
+        await db.collection("user_settings").document("_warmup").get()
+    except Exception as e:
+        logger.warning(f"Firestore warm-up read failed: {e}")
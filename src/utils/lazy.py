@@ -0,0 +1,36 @@
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+class LazySingleton(Generic[T]):
+    """
+    Builds a value on first call and returns the same value afterwards.
+    Safe to call from worker threads (warm-up runs factories via to_thread).
+    A factory that raises is retried on the next call.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self._lock = threading.Lock()
+        self._built = False
+        self._value = None
+
+    def __call__(self) -> T:
+        if self._built:
+            return self._value
+        with self._lock:
+            if not self._built:
+                self._value = self.factory()
+                self._built = True
+        return self._value
+
+    def override(self, value: T):
+        """Replaces the value (fake backends in benchmarks)."""
+        with self._lock:
+            self._value = value
+            self._built = True
+
+    @property
+    def initialized(self) -> bool:
+        return self._built
@@ -0,0 +1,8 @@
+from typing import Optional
+from aiogram.types import InlineKeyboardMarkup
+
+def same_markup(current: Optional[InlineKeyboardMarkup], new: Optional[InlineKeyboardMarkup]) -> bool:
+    """True if editing `current` to `new` would not change what the user sees."""
+    if current is None or new is None:
+        return current is new
+    return current.model_dump(exclude_none=True) == new.model_dump(exclude_none=True)
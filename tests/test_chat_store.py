@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+from src.services.chat_store import ConversationStore
+
+class FakeDoc:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    async def get(self):
+        data = self.db.docs.get(self.id)
+        return SimpleNamespace(exists=data is not None, to_dict=lambda: data)
+
+    async def delete(self):
+        self.db.docs.pop(self.id, None)
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = {}
+
+    def set(self, ref, data):
+        self.writes[ref.id] = data
+
+    async def commit(self):
+        await asyncio.sleep(self.db.commit_delay)
+        if self.db.fail:
+            self.db.fail -= 1
+            raise ValueError("commit failed")
+        self.db.commits.append(len(self.writes))
+        self.db.docs.update(self.writes)
+
+class FakeDB:
+    """Firestore stand-in with just what the store's flush uses; `fail` commits fail first."""
+
+    def __init__(self, fail: int = 0, commit_delay: float = 0.0):
+        self.docs = {}
+        self.commits = []
+        self.fail = fail
+        self.commit_delay = commit_delay
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return FakeDoc(self, doc_id)
+
+    def batch(self):
+        return FakeBatch(self)
+
+def make_store(db, **kwargs) -> ConversationStore:
+    return ConversationStore(lambda: db, **{"flush_interval": 3600, **kwargs})
+
+async def test_append_is_written_on_flush():
+    db = FakeDB()
+    store = make_store(db)
+    await store.append(1, "hi", "hello")
+    await store.append(1, "how are you", "fine")
+    await store.append(2, "ping", "pong")
+    assert db.docs == {}
+    await store.close()
+    assert db.commits == [2]
+    assert [m["parts"] for m in db.docs["1"]["history"]] == [["hi"], ["hello"], ["how are you"], ["fine"]]
+    assert db.docs["2"]["summary"] == ""
+
+async def test_flush_batches_at_most_500_writes():
+    db = FakeDB()
+    store = make_store(db)
+    for user_id in range(1200):
+        await store.append(user_id, "q", "a")
+    await store.close()
+    assert db.commits == [500, 500, 200]
+
+async def test_failed_flush_keeps_changes_for_the_next_one():
+    db = FakeDB(fail=1)
+    store = make_store(db)
+    await store.append(1, "first", "reply")
+    await store.flush()
+    assert db.docs == {}
+    await store.close()
+    assert db.docs["1"]["history"][0]["parts"] == ["first"]
+
+async def test_close_waits_for_a_flush_under_way():
+    db = FakeDB(commit_delay=0.2)
+    store = make_store(db, flush_interval=0.01)
+    await store.append(1, "hi", "hello")
+    # The background flush has taken the history and is committing it
+    await asyncio.sleep(0.05)
+    await store.close()
+    assert db.docs["1"]["history"][0]["parts"] == ["hi"]
+
+async def test_append_after_eviction_keeps_the_stored_history():
+    db = FakeDB()
+    db.docs["1"] = {"history": [{"role": "user", "parts": ["q0"]}, {"role": "model", "parts": ["a0"]}], "summary": "S"}
+    store = make_store(db, maxsize=1)
+    await store.get_history(1)
+    # Another user's message pushes this one out of the cache before the reply is ready
+    await store.get_history(2)
+    await store.append(1, "q1", "a1")
+    await store.close()
+    assert [m["parts"][0] for m in db.docs["1"]["history"]] == ["q0", "a0", "q1", "a1"]
+    assert db.docs["1"]["summary"] == "S"
+
+async def test_history_is_capped():
+    store = make_store(FakeDB(), history_limit=4)
+    for i in range(5):
+        await store.append(1, f"q{i}", f"a{i}")
+    history = await store.get_history(1)
+    await store.close()
+    assert [c.parts[0].text for c in history] == ["q3", "a3", "q4", "a4"]
+
+async def test_history_is_trimmed_to_the_budget():
+    # Each turn here costs 1 token, so 6 tokens fit three pairs
+    store = make_store(FakeDB(), budgets={"flash": 6})
+    for i in range(5):
+        await store.append(1, f"q{i}", f"a{i}")
+    history = await store.get_history(1)
+    await store.close()
+    assert [c.parts[0].text for c in history] == ["q2", "a2", "q3", "a3", "q4", "a4"]
+
+async def test_old_turns_are_folded_into_the_summary():
+    folded = []
+
+    async def summarize(previous, turns):
+        folded.extend(t["parts"][0] for t in turns)
+        return "S"
+
+    db = FakeDB()
+    store = make_store(db, budgets={"flash": 6}, summarize=summarize)
+    for i in range(5):
+        await store.append(1, f"q{i}", f"a{i}")
+    store.summarize_later(1)
+    await asyncio.gather(*store._summary_tasks.values())
+    history = await store.get_history(1)
+    await store.close()
+    # The newest pair within half the budget stays
+    assert folded == ["q0", "a0", "q1", "a1", "q2", "a2", "q3", "a3"]
+    assert history[0].parts[0].text.endswith("\nS")
+    assert [c.parts[0].text for c in history[2:]] == ["q4", "a4"]
+    assert db.docs["1"]["summary"] == "S"
+    assert len(db.docs["1"]["history"]) == 2
+
+async def test_fold_is_dropped_if_history_changed():
+    store = make_store(FakeDB(), budgets={"flash": 6})
+
+    async def summarize(previous, turns):
+        # The user clears the chat and starts over meanwhile
+        await store.clear(1)
+        await store.append(1, "new", "start")
+        return "S"
+
+    store.summarize = summarize
+    for i in range(5):
+        await store.append(1, f"q{i}", f"a{i}")
+    store.summarize_later(1)
+    await asyncio.sleep(0.01)
+    history = await store.get_history(1)
+    await store.close()
+    assert [c.parts[0].text for c in history] == ["new", "start"]
+
+async def test_no_fold_within_budget():
+    calls = []
+
+    async def summarize(previous, turns):
+        calls.append(turns)
+        return "S"
+
+    store = make_store(FakeDB(), budgets={"flash": 100}, summarize=summarize)
+    await store.append(1, "q", "a")
+    store.summarize_later(1)
+    assert not store._summary_tasks
+    await store.close()
+    assert calls == []
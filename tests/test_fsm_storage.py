@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from src.fsm_storage import CachedFSMStorage, InMemoryFSMBackend, FSMRecord
+from src.states import GenStates
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+async def test_state_and_data_round_trip():
+    storage = CachedFSMStorage(InMemoryFSMBackend())
+    await storage.set_state(KEY, GenStates.prompt_wait)
+    await storage.set_data(KEY, {"a": 1})
+    assert await storage.get_state(KEY) == GenStates.prompt_wait.state
+    assert await storage.get_data(KEY) == {"a": 1}
+    assert await storage.update_data(KEY, {"b": 2}) == {"a": 1, "b": 2}
+    # State and data changes don't clobber each other
+    assert await storage.get_state(KEY) == GenStates.prompt_wait.state
+
+async def test_every_write_bumps_the_version():
+    backend = InMemoryFSMBackend()
+    storage = CachedFSMStorage(backend)
+    await storage.set_state(KEY, "s")
+    await storage.update_data(KEY, {"a": 1})
+    assert backend.records[CachedFSMStorage._doc_id(KEY)].version == 2
+
+async def test_returned_data_is_a_copy():
+    storage = CachedFSMStorage(InMemoryFSMBackend())
+    await storage.set_data(KEY, {"items": [1]})
+    data = await storage.get_data(KEY)
+    data["items"].append(2)
+    assert await storage.get_data(KEY) == {"items": [1]}
+
+async def test_concurrent_instances_merge_updates():
+    backend = InMemoryFSMBackend()
+    # Two instances with long-lived caches: the second one reads stale data
+    first = CachedFSMStorage(backend, cache_ttl=60)
+    second = CachedFSMStorage(backend, cache_ttl=60)
+    await first.get_data(KEY)
+    await second.get_data(KEY)
+
+    await first.update_data(KEY, {"a": 1})
+    await second.update_data(KEY, {"b": 2})
+
+    assert await CachedFSMStorage(backend).get_data(KEY) == {"a": 1, "b": 2}
+    assert await second.get_data(KEY) == {"a": 1, "b": 2}
+
+async def test_concurrent_updates_in_one_instance_are_not_lost():
+    storage = CachedFSMStorage(InMemoryFSMBackend())
+    await asyncio.gather(*(storage.update_data(KEY, {f"k{i}": i}) for i in range(10)))
+    assert await storage.get_data(KEY) == {f"k{i}": i for i in range(10)}
+
+async def test_persistent_conflict_raises():
+    class AlwaysConflicting(InMemoryFSMBackend):
+        async def write(self, doc_id: str, record: FSMRecord, expected_version: int) -> bool:
+            return False
+
+    storage = CachedFSMStorage(AlwaysConflicting())
+    with pytest.raises(RuntimeError):
+        await storage.set_state(KEY, "s")
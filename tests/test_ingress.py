@@ -0,0 +1,78 @@
+import asyncio
+import time
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Message, Update
+from src.ingress import UpdatePipeline, ACCEPTED, DUPLICATE, BUSY
+
+BOT = Bot(token="123456:TEST")
+USER = {"id": 10, "is_bot": False, "first_name": "test"}
+CHAT = {"id": 10, "type": "private"}
+
+def message(update_id: int, text: str) -> Update:
+    return Update.model_validate({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": CHAT, "from": USER, "text": text
+    }})
+
+def callback(update_id: int, data: str) -> Update:
+    return Update.model_validate({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": USER, "chat_instance": "1", "data": data,
+        "message": {"message_id": 1, "date": 0, "chat": CHAT, "text": "menu"}
+    }})
+
+def make_pipeline(handled: list, message_delay: float = 0.0, **kwargs) -> UpdatePipeline:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(message: Message):
+        await asyncio.sleep(message_delay)
+        handled.append((message.text, time.perf_counter()))
+
+    @dp.callback_query()
+    async def on_callback(callback: CallbackQuery):
+        handled.append((callback.data, time.perf_counter()))
+
+    return UpdatePipeline(dp, BOT, workers=kwargs.pop("workers", 4), **kwargs)
+
+async def drain(pipeline: UpdatePipeline):
+    while pipeline.queued or pipeline.in_flight:
+        await asyncio.sleep(0.01)
+
+async def test_messages_of_a_chat_run_in_order():
+    handled = []
+    pipeline = make_pipeline(handled, message_delay=0.01)
+    pipeline.start()
+    for i in range(5):
+        pipeline.submit(message(i, f"m{i}"))
+    await drain(pipeline)
+    await pipeline.stop()
+    assert [text for text, _ in handled] == [f"m{i}" for i in range(5)]
+
+async def test_callback_is_not_blocked_by_a_long_message():
+    handled = []
+    pipeline = make_pipeline(handled, message_delay=1.0)
+    pipeline.start()
+    pipeline.submit(message(1, "generate"))
+    await asyncio.sleep(0.01)
+    submitted = time.perf_counter()
+    pipeline.submit(callback(2, "button"))
+    await drain(pipeline)
+    await pipeline.stop()
+    assert [text for text, _ in handled] == ["button", "generate"]
+    assert handled[0][1] - submitted < 0.5
+
+async def test_redelivered_update_is_dropped():
+    handled = []
+    pipeline = make_pipeline(handled)
+    pipeline.start()
+    assert pipeline.submit(message(1, "hi")) == ACCEPTED
+    assert pipeline.submit(message(1, "hi")) == DUPLICATE
+    await drain(pipeline)
+    await pipeline.stop()
+    assert len(handled) == 1
+
+async def test_full_queue_reports_busy():
+    pipeline = make_pipeline([], max_queue=2)
+    assert pipeline.submit(message(1, "a")) == ACCEPTED
+    assert pipeline.submit(message(2, "b")) == ACCEPTED
+    assert pipeline.submit(message(3, "c")) == BUSY
+    assert pipeline.rejected == 1
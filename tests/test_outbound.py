@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from src.middlewares.outbound import OutboundScheduler, bulk
+
+BOT = Bot(token="123456:TEST")
+MARKUP = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="ok", callback_data="ok")]])
+
+class FakeApi:
+    """make_request stand-in that records calls; `fail` RetryAfter errors come first."""
+
+    def __init__(self, fail: int = 0, delay: float = 0.0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+
+    async def __call__(self, bot, method):
+        self.calls.append(method)
+        if self.fail:
+            self.fail -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        await asyncio.sleep(self.delay)
+        return method.text if isinstance(method, (SendMessage, EditMessageText)) else True
+
+def fast(**kwargs) -> OutboundScheduler:
+    return OutboundScheduler(**{"global_rate": 1000, "chat_rate": 1000, "chat_burst": 1000, **kwargs})
+
+async def test_sends_in_order_and_returns_results():
+    api, scheduler = FakeApi(), fast()
+    results = [await scheduler(api, BOT, SendMessage(chat_id=1, text=f"m{i}")) for i in range(3)]
+    await scheduler.close()
+    assert results == ["m0", "m1", "m2"]
+    assert [m.text for m in api.calls] == ["m0", "m1", "m2"]
+
+async def test_unscheduled_methods_go_straight_through():
+    api, scheduler = FakeApi(), fast()
+    assert await scheduler(api, BOT, AnswerCallbackQuery(callback_query_id="1")) is True
+    assert scheduler._runner is None
+
+async def test_long_plain_text_is_split():
+    api, scheduler = FakeApi(), fast()
+    text = "a" * 4000 + "\n" + "b" * 4000 + "\n" + "c" * 100
+    result = await scheduler(api, BOT, SendMessage(chat_id=1, text=text, reply_markup=MARKUP))
+    await scheduler.close()
+    assert [len(m.text) for m in api.calls] == [4000, 4000, 100]
+    # Buttons under the last part; the caller gets the first message
+    assert [m.reply_markup for m in api.calls] == [None, None, MARKUP]
+    assert result == "a" * 4000
+
+async def test_text_with_markup_is_not_split():
+    api, scheduler = FakeApi(), fast()
+    await scheduler(api, BOT, SendMessage(chat_id=1, text="<b>x</b>" * 1000, parse_mode="HTML"))
+    await scheduler.close()
+    assert len(api.calls) == 1
+
+async def test_queued_edit_is_superseded():
+    # Everything after the first message waits for the chat's next token
+    api, scheduler = FakeApi(), fast(chat_rate=10, group_rate=10, chat_burst=1)
+    first = asyncio.create_task(scheduler(api, BOT, SendMessage(chat_id=1, text="first")))
+    await asyncio.sleep(0.01)
+    edits = [
+        asyncio.create_task(scheduler(api, BOT, EditMessageText(chat_id=1, message_id=7, text=f"v{i}")))
+        for i in range(3)
+    ]
+    results = await asyncio.gather(first, *edits)
+    await scheduler.close()
+    assert [m.text for m in api.calls] == ["first", "v2"]
+    assert results == ["first", "v2", "v2", "v2"]
+
+async def test_interactive_replies_go_before_status_edits_and_bulk():
+    api, scheduler = FakeApi(), fast(chat_rate=20, group_rate=20, chat_burst=1)
+    blocker = asyncio.create_task(scheduler(api, BOT, SendMessage(chat_id=1, text="blocker")))
+    await asyncio.sleep(0.01)
+
+    async def broadcast():
+        with bulk():
+            return await scheduler(api, BOT, SendMessage(chat_id=1, text="bulk"))
+
+    tasks = [
+        asyncio.create_task(broadcast()),
+        asyncio.create_task(scheduler(api, BOT, EditMessageText(chat_id=1, message_id=7, text="status"))),
+        asyncio.create_task(scheduler(api, BOT, SendMessage(chat_id=1, text="reply"))),
+    ]
+    await asyncio.gather(blocker, *tasks)
+    await scheduler.close()
+    assert [m.text for m in api.calls] == ["blocker", "reply", "status", "bulk"]
+
+async def test_retry_after_is_retried_transparently():
+    api, scheduler = FakeApi(fail=2), fast()
+    result = await scheduler(api, BOT, SendMessage(chat_id=1, text="hi"))
+    await scheduler.close()
+    assert result == "hi"
+    assert len(api.calls) == 3
+
+async def test_persistent_retry_after_is_raised():
+    api, scheduler = FakeApi(fail=10), fast(max_retries=2)
+    with pytest.raises(TelegramRetryAfter):
+        await scheduler(api, BOT, SendMessage(chat_id=1, text="hi"))
+    await scheduler.close()
+
+async def test_cancelled_caller_does_not_send():
+    api, scheduler = FakeApi(), fast(chat_rate=5, group_rate=5, chat_burst=1)
+    await scheduler(api, BOT, SendMessage(chat_id=1, text="first"))
+    task = asyncio.create_task(scheduler(api, BOT, SendMessage(chat_id=1, text="gone")))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.3)
+    await scheduler.close()
+    assert [m.text for m in api.calls] == ["first"]
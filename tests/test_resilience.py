@@ -0,0 +1,128 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from google.api_core import exceptions as gexc
+from src.services.resilience import (
+    RetryPolicy, CircuitBreaker, CircuitOpenError, is_transient, retry_after
+)
+
+class Backend:
+    """Call stand-in: raises the queued errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors: Exception, delay: float = 0.0):
+        self.errors = list(errors)
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+def fast_policy(**kwargs) -> RetryPolicy:
+    return RetryPolicy("test", **{"base_delay": 0.001, "max_delay": 0.001, "min_attempt": 0.0, **kwargs})
+
+def test_transient_errors():
+    assert is_transient(gexc.ServiceUnavailable("down"))
+    assert is_transient(gexc.ResourceExhausted("quota"))
+    assert is_transient(ConnectionError())
+    assert not is_transient(gexc.InvalidArgument("bad"))
+    assert not is_transient(ValueError())
+
+def test_retry_hints():
+    response = SimpleNamespace(headers={"Retry-After": "7"})
+    assert retry_after(gexc.TooManyRequests("slow down", response=response)) == 7.0
+    info = SimpleNamespace(retry_delay=SimpleNamespace(seconds=1, nanos=500_000_000))
+    assert retry_after(gexc.ResourceExhausted("quota", details=[info])) == 1.5
+    assert retry_after(gexc.ServiceUnavailable("down")) is None
+
+async def test_transient_errors_are_retried():
+    backend = Backend(gexc.ServiceUnavailable("down"), gexc.Aborted("conflict"))
+    assert await fast_policy().call(backend) == "ok"
+    assert backend.calls == 3
+
+async def test_other_errors_are_raised_at_once():
+    backend = Backend(gexc.InvalidArgument("bad"))
+    with pytest.raises(gexc.InvalidArgument):
+        await fast_policy().call(backend)
+    assert backend.calls == 1
+
+async def test_gives_up_after_max_attempts():
+    backend = Backend(*[gexc.ServiceUnavailable("down")] * 5)
+    with pytest.raises(gexc.ServiceUnavailable):
+        await fast_policy(max_attempts=3).call(backend)
+    assert backend.calls == 3
+
+async def test_attempt_is_cut_off_at_the_deadline():
+    backend = Backend(delay=10.0)
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        await fast_policy(deadline=0.2).call(backend)
+    assert time.monotonic() - started < 1.0
+
+async def test_retry_hint_is_honoured():
+    info = SimpleNamespace(retry_delay=SimpleNamespace(seconds=0, nanos=200_000_000))
+    backend = Backend(gexc.ResourceExhausted("quota", details=[info]))
+    started = time.monotonic()
+    assert await fast_policy().call(backend) == "ok"
+    assert time.monotonic() - started >= 0.2
+
+async def test_no_retry_without_time_for_an_attempt():
+    # 1 s left, but an attempt needs at least 2 s
+    backend = Backend(gexc.ServiceUnavailable("down"))
+    with pytest.raises(gexc.ServiceUnavailable):
+        await fast_policy(deadline=1.0, min_attempt=2.0).call(backend)
+    assert backend.calls == 1
+
+async def test_breaker_opens_and_rejects_without_calling():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60.0)
+    policy = fast_policy(max_attempts=1, breaker=breaker)
+    backend = Backend(*[gexc.ServiceUnavailable("down")] * 2)
+    for _ in range(2):
+        with pytest.raises(gexc.ServiceUnavailable):
+            await policy.call(backend)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await policy.call(backend)
+    assert backend.calls == 2
+
+async def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    policy = fast_policy(max_attempts=1, breaker=breaker)
+    with pytest.raises(gexc.ServiceUnavailable):
+        await policy.call(Backend(gexc.ServiceUnavailable("down")))
+    await asyncio.sleep(0.06)
+    assert breaker.state == "half_open"
+
+    probe = Backend(delay=0.05)
+    results = await asyncio.gather(policy.call(probe), policy.call(probe), return_exceptions=True)
+    assert results[0] == "ok"
+    assert isinstance(results[1], CircuitOpenError)
+    assert probe.calls == 1
+    assert breaker.state == "closed"
+
+async def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    policy = fast_policy(max_attempts=1, breaker=breaker)
+    with pytest.raises(gexc.ServiceUnavailable):
+        await policy.call(Backend(gexc.ServiceUnavailable("down")))
+    await asyncio.sleep(0.06)
+    with pytest.raises(gexc.ServiceUnavailable):
+        await policy.call(Backend(gexc.ServiceUnavailable("still down")))
+    assert breaker.state == "open"
+
+async def test_cancelled_probe_frees_the_half_open_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    policy = fast_policy(max_attempts=1, breaker=breaker)
+    with pytest.raises(gexc.ServiceUnavailable):
+        await policy.call(Backend(gexc.ServiceUnavailable("down")))
+    await asyncio.sleep(0.06)
+    probe = asyncio.create_task(policy.call(Backend(delay=10.0)))
+    await asyncio.sleep(0.01)
+    probe.cancel()
+    await asyncio.gather(probe, return_exceptions=True)
+    assert await policy.call(Backend()) == "ok"
+    assert breaker.state == "closed"
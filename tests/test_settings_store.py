@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+from src.settings_store import SettingsRepository, DEFAULT_SETTINGS
+
+class FakeDoc:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    async def get(self):
+        data = self.db.docs.get(self.id)
+        return SimpleNamespace(exists=data is not None, to_dict=lambda: dict(data))
+
+    async def set(self, data, merge=False):
+        self.db.docs.setdefault(self.id, {}).update(data)
+
+class FakeDB:
+    """Firestore stand-in for the async client and the listener of the sync one."""
+
+    def __init__(self):
+        self.docs = {}
+        self.listener = None
+        self.unsubscribed = False
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return FakeDoc(self, doc_id)
+
+    def where(self, filter):
+        return self
+
+    def on_snapshot(self, callback):
+        self.listener = callback
+        return SimpleNamespace(unsubscribe=lambda: setattr(self, "unsubscribed", True))
+
+    def changed(self, doc_id: str):
+        # The listener calls back from its own thread
+        change = SimpleNamespace(document=SimpleNamespace(id=doc_id))
+        thread = threading.Thread(target=self.listener, args=([], [change], None))
+        thread.start()
+        thread.join()
+
+def make_repo(db) -> SettingsRepository:
+    return SettingsRepository(lambda: db, cache_ttl=3600, write_delay=0.01, watch_client_factory=lambda: db)
+
+async def test_change_elsewhere_drops_the_cached_settings():
+    db = FakeDB()
+    repo = make_repo(db)
+    await repo.watch()
+    assert (await repo.get(1))["style"] == DEFAULT_SETTINGS["style"]
+
+    # Another instance writes the document
+    db.docs["1"] = {"style": "anime", "updated_at": 1}
+    assert (await repo.get(1))["style"] == DEFAULT_SETTINGS["style"]
+    db.changed("1")
+    await asyncio.sleep(0)
+    assert (await repo.get(1))["style"] == "anime"
+    await repo.close()
+    assert db.unsubscribed
+
+async def test_writes_are_stamped_for_the_listeners():
+    db = FakeDB()
+    repo = make_repo(db)
+    settings = await repo.apply(1, "style", "anime")
+    await repo.close()
+    assert settings["style"] == "anime"
+    assert "updated_at" in db.docs["1"]
+    # The stamp is not a setting
+    assert "updated_at" not in await make_repo(db).get(1)
+
+async def test_no_listener_without_a_client():
+    repo = SettingsRepository(lambda: None, watch_client_factory=lambda: None)
+    await repo.watch()
+    assert await repo.get(1) == DEFAULT_SETTINGS
+    await repo.close()
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from src.utils.singleflight import SingleFlight
+
+class Counter:
+    """Call stand-in: counts calls and blocks until released."""
+
+    def __init__(self, result="done", error: Exception = None):
+        self.calls = 0
+        self.cancelled = False
+        self.result = result
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+async def test_concurrent_callers_share_one_call():
+    flight, func = SingleFlight(), Counter()
+    tasks = [asyncio.create_task(flight.do("k", func)) for _ in range(3)]
+    await asyncio.sleep(0)
+    func.release.set()
+    assert await asyncio.gather(*tasks) == [("done", False), ("done", True), ("done", True)]
+    assert func.calls == 1
+    assert len(flight) == 0
+
+async def test_different_keys_run_separately():
+    flight, func = SingleFlight(), Counter()
+    tasks = [asyncio.create_task(flight.do(key, func)) for key in ("a", "b")]
+    await asyncio.sleep(0)
+    func.release.set()
+    assert await asyncio.gather(*tasks) == [("done", False), ("done", False)]
+    assert func.calls == 2
+
+async def test_key_is_forgotten_after_completion():
+    flight, func = SingleFlight(), Counter()
+    func.release.set()
+    assert await flight.do("k", func) == ("done", False)
+    assert await flight.do("k", func) == ("done", False)
+    assert func.calls == 2
+
+async def test_exception_reaches_every_caller():
+    flight, func = SingleFlight(), Counter(error=ValueError("boom"))
+    tasks = [asyncio.create_task(flight.do("k", func)) for _ in range(2)]
+    await asyncio.sleep(0)
+    func.release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert func.calls == 1
+    assert len(flight) == 0
+
+async def test_cancelled_caller_leaves_the_call_to_others():
+    flight, func = SingleFlight(), Counter()
+    first = asyncio.create_task(flight.do("k", func))
+    second = asyncio.create_task(flight.do("k", func))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    func.release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert await second == ("done", True)
+    assert not func.cancelled
+
+async def test_call_is_cancelled_with_its_last_caller():
+    flight, func = SingleFlight(), Counter()
+    tasks = [asyncio.create_task(flight.do("k", func)) for _ in range(2)]
+    await asyncio.sleep(0)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.sleep(0)
+    assert func.cancelled
+    assert len(flight) == 0
+    # A new caller starts a new call
+    func.release.set()
+    assert await flight.do("k", func) == ("done", False)
+    assert func.calls == 2
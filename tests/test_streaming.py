@@ -0,0 +1,27 @@
+from src.services.streaming import split_text
+
+def test_short_text_is_one_chunk():
+    assert split_text("hello", limit=10) == ["hello"]
+
+def test_prefers_line_breaks():
+    text = "a" * 6 + "\n" + "b" * 6
+    assert split_text(text, limit=10) == ["a" * 6, "b" * 6]
+
+def test_falls_back_to_spaces():
+    text = "a" * 6 + " " + "b" * 6
+    assert split_text(text, limit=10) == ["a" * 6, " " + "b" * 6]
+
+def test_hard_cut_without_breaks():
+    assert split_text("x" * 25, limit=10) == ["x" * 10, "x" * 10, "x" * 5]
+
+def test_ignores_breaks_too_early_in_the_chunk():
+    # A break in the first half would leave a tiny chunk; cut at the limit instead
+    text = "a\n" + "b" * 20
+    assert split_text(text, limit=10) == ["a\n" + "b" * 8, "b" * 10, "b" * 2]
+
+def test_chunks_fit_and_keep_the_text():
+    text = "\n\n".join(f"Paragraph {i}. " + "word " * 300 for i in range(10))
+    chunks = split_text(text)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
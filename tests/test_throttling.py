@@ -0,0 +1,37 @@
+from src.middlewares.throttling import TokenBucket, RateLimitMiddleware
+
+def test_bucket_allows_burst_then_refills():
+    bucket = TokenBucket(rate=2.0, burst=3, now=0.0)
+    assert [bucket.consume(0.0) for _ in range(4)] == [True, True, True, False]
+    # Half a second at 2 tokens/s is one token
+    assert bucket.consume(0.5)
+    assert not bucket.consume(0.5)
+
+def test_bucket_does_not_refill_past_burst():
+    bucket = TokenBucket(rate=1.0, burst=2, now=0.0)
+    assert bucket.consume(100.0)
+    assert bucket.consume(100.0)
+    assert not bucket.consume(100.0)
+
+def test_users_are_limited_separately():
+    limiter = RateLimitMiddleware(rate=1.0, burst=1)
+    assert limiter.allow(1, 0.0)
+    assert not limiter.allow(1, 0.1)
+    assert limiter.allow(2, 0.1)
+    assert limiter.allow(1, 1.1)
+
+def test_global_bucket_limits_all_users():
+    limiter = RateLimitMiddleware(rate=10.0, burst=10, global_bucket=TokenBucket(1.0, 2, now=0.0))
+    assert limiter.allow(1, 0.0)
+    assert limiter.allow(2, 0.0)
+    assert not limiter.allow(3, 0.0)
+
+def test_idle_buckets_are_evicted():
+    limiter = RateLimitMiddleware(rate=1.0, burst=1, idle_ttl=60.0)
+    for user_id in range(100):
+        limiter.allow(user_id, 0.0)
+    limiter.allow(1, 30.0)
+    assert len(limiter.buckets) == 100
+    limiter.allow(1000, 61.0)
+    # Only the user seen at 30s and the new one are left
+    assert list(limiter.buckets) == [1, 1000]
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import CallbackQuery, Update
+from src.ingress import UpdatePipeline
+from src.services.vertex_ai import VertexAIService
+
+BOT = Bot(token="123456:TEST")
+USER = {"id": 10, "is_bot": False, "first_name": "test"}
+CHAT = {"id": 10, "type": "private"}
+
+class FakeImageModel:
+    """Image model stand-in: counts calls, each taking `delay` seconds."""
+
+    def __init__(self, delay: float = 0.2):
+        self.calls = 0
+        self.delay = delay
+
+    async def generate_content_async(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        part = SimpleNamespace(text="a cat", inline_data=SimpleNamespace(data=b"image"))
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+def regenerate(update_id: int) -> Update:
+    return Update.model_validate({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": USER, "chat_instance": "1", "data": "img_regenerate",
+        "message": {"message_id": 1, "date": 0, "chat": CHAT, "caption": "✨ a cat"}
+    }})
+
+async def test_double_tap_makes_one_model_call():
+    service, model = VertexAIService(), FakeImageModel()
+    service._models["image"].override(model)
+    results = []
+
+    dp = Dispatcher()
+
+    @dp.callback_query(F.data == "img_regenerate")
+    async def on_regenerate(callback: CallbackQuery):
+        results.append(await service.generate_image("a cat", user_id=callback.from_user.id))
+
+    pipeline = UpdatePipeline(dp, BOT, workers=4)
+    pipeline.start()
+    # Two taps on "🔄" in quick succession, as separate updates
+    pipeline.submit(regenerate(1))
+    await asyncio.sleep(0.05)
+    pipeline.submit(regenerate(2))
+    await pipeline.stop()
+
+    assert model.calls == 1
+    assert results == [(b"image", "a cat")] * 2
+
+async def test_other_users_are_not_coalesced():
+    service, model = VertexAIService(), FakeImageModel()
+    service._models["image"].override(model)
+    await asyncio.gather(
+        service.generate_image("a cat", user_id=1),
+        service.generate_image("a cat", user_id=2),
+    )
+    assert model.calls == 2